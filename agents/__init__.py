@@ -1,2 +1,3 @@
 from .fixed_agent import SingleProductFixedAgent
 from .manual_agent import ManualAgent, create_manual_agent
+from .replay_agent import ReplayAgent, ReplayedAgent
@@ -1,7 +1,6 @@
 from typing import Callable, Tuple, Union
 import pygame
 
-from util import effective_inf
 from trading_objects import Agent, Exchange, Order, Event
 from command_display import CommandDisplay, Command, Argument
 
@@ -33,7 +32,7 @@ class ManualAgent(Agent):
                 Command(
                     self.order_id_wrapper(self.bid),
                     args_definitions=[
-                        Argument(float, effective_inf),
+                        Argument(float, None),
                         Argument(int, 1),
                         Argument(int, None),
                     ],
@@ -42,7 +41,7 @@ class ManualAgent(Agent):
                 Command(
                     self.order_id_wrapper(self.ask),
                     args_definitions=[
-                        Argument(float, 0),
+                        Argument(float, None),
                         Argument(int, 1),
                         Argument(int, None),
                     ],
@@ -133,11 +132,13 @@ class ManualAgent(Agent):
         self.max_events_stored = max_events_stored
         self.event_column_width = event_column_width
         self.events_color = events_color
+        # Snapshot of the books taken in the simulation thread each tick, read
+        # by the display thread
+        self.order_books = {}
 
     def register_exchange(self, exchange: Exchange) -> None:
         super().register_exchange(exchange)
 
-        self.events = []
         self.event_types_map = {
             "trades": Event.TRADE,
             "bids": Event.BID,
@@ -147,12 +148,12 @@ class ManualAgent(Agent):
         self.allowed_event_types = set(self.event_types_map.values())
         self.allowed_symbols = set(exchange.symbols)
 
-        exchange.subscribe(self, self.process_event)
+        exchange.enable_event_log(self.max_events_stored)
 
-    def process_event(self, event: Event) -> None:
-        self.events.append(event)
-        if len(self.events) > 1.5 * self.max_events_stored:
-            self.events = self.events[-self.max_events_stored :]
+    def update(self) -> None:
+        super().update()
+        order_books = self.exchange.public_info()
+        self.order_books = {symbol: order_books[symbol] for symbol in order_books}
 
     def update_event_symbols(self, symbol: str, operation: int) -> None:
         symbol = symbol.upper()
@@ -197,6 +198,30 @@ class ManualAgent(Agent):
         self.cur_symbol = symbol.upper()
         return f"Selected {self.cur_symbol}"
 
+    def bid(
+        self,
+        price: Union[float, None],
+        size: int,
+        symbol: Union[str, None] = None,
+        exchange_name: Union[str, None] = None,
+        frames_to_expire: Union[int, None] = None,
+    ) -> int:
+        if price is None:
+            return self.take(size, exchange_name=exchange_name, symbol=symbol)
+        return super().bid(price, size, symbol, exchange_name, frames_to_expire)
+
+    def ask(
+        self,
+        price: Union[float, None],
+        size: int,
+        symbol: Union[str, None] = None,
+        exchange_name: Union[str, None] = None,
+        frames_to_expire: Union[int, None] = None,
+    ) -> int:
+        if price is None:
+            return self.sell(size, exchange_name=exchange_name, symbol=symbol)
+        return super().ask(price, size, symbol, exchange_name, frames_to_expire)
+
     def cancel(self, order_id: int) -> None:
         order_id = super().cancel(order_id)
         if order_id is None:
@@ -291,7 +316,7 @@ class ManualAgent(Agent):
         if self.cur_symbol is None:
             self.select_symbol(self.cur_symbol)
 
-        order_books = self.exchange.public_info()
+        order_books = self.order_books
 
         cur_x = x
         starting_y = y
@@ -391,19 +416,21 @@ class ManualAgent(Agent):
 
     def visualize_events(self, x: int, y: int, w: int, h: int) -> None:
         def to_line(symbol, price, size, event_type):
-            symbol = symbol.upper()
             event_type_str = self.event_type_reverse_map[event_type][:-1].upper()
             return f"{symbol:<{self.event_column_width}}{price:<{self.event_column_width}}{size:<{self.event_column_width}}{event_type_str:<{self.event_column_width}}"
 
+        event_log = self.exchange.event_log
+        rows = event_log.latest(self.max_events_stored).tolist()
+
         lines = [
             f"{'Symbol':<{self.event_column_width}}{'Price':<{self.event_column_width}}{'Size':<{self.event_column_width}}{'Event Type':<{self.event_column_width}}"
         ] + list(
             reversed(
                 [
-                    to_line(event.symbol, event.price, event.size, event.event_type)
-                    for event in self.events
-                    if event.symbol in self.allowed_symbols
-                    and event.event_type in self.allowed_event_types
+                    to_line(event_log.symbol(symbol_id), price, size, event_type)
+                    for _, _, symbol_id, event_type, price, size, _ in rows
+                    if event_log.symbol(symbol_id) in self.allowed_symbols
+                    and event_type in self.allowed_event_types
                 ]
             )
         )
@@ -0,0 +1,99 @@
+from typing import Dict, Union
+
+import numpy as np
+
+from simulation import Time
+from trading_objects import Agent, Exchange, Order
+from journal import Journal, JournalReader
+
+
+class ReplayedAgent(Agent):
+    # Stands in for one agent of a recorded run. It has an account on the
+    # exchange but no behavior of its own.
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        self.name = name
+
+
+class ReplayAgent(Agent):
+    # Re-submits the order, cancel and amend requests of a recorded journal at
+    # the ticks they were made, each on behalf of a ReplayedAgent standing in
+    # for the agent that made it, so live agents can trade against the
+    # recorded flow. Trades are not replayed; they come from matching the
+    # replayed orders against the books again. Requests made from callbacks
+    # while the books were updating are replayed with the rest of their tick.
+    # The recording is replayed from the first update on, so a journal can be
+    # replayed at any point in a process.
+    def __init__(self, journal_path: str) -> None:
+        super().__init__()
+        self.reader = JournalReader(journal_path)
+        rows = self.reader.rows
+        self.requests = np.asarray(
+            rows[
+                (rows["kind"] == Journal.ORDER)
+                | (rows["kind"] == Journal.CANCEL)
+                | (rows["kind"] == Journal.AMEND)
+            ]
+        )
+        self.replayed_agents = [ReplayedAgent(name) for name in self.reader.agents]
+        # Recorded order id -> replayed order
+        self.replayed_orders: Dict[int, Order] = {}
+        self.__next = 0
+        self.__offset: Union[int, None] = None
+
+    @property
+    def num_ticks(self) -> int:
+        # Ticks from the start of the recording through its last request
+        if len(self.requests) == 0:
+            return 0
+        return int(self.requests["time"][-1]) - self.reader.start_time + 1
+
+    def register_exchange(self, exchange: Exchange) -> None:
+        super().register_exchange(exchange)
+        for replayed_agent in self.replayed_agents:
+            exchange.register_agent(replayed_agent)
+
+    def update(self) -> None:
+        super().update()
+        if self.__offset is None:
+            self.__offset = Time.now - self.reader.start_time
+        # The recorded tick replayed now
+        now = Time.now - self.__offset
+        times = self.requests["time"]
+        start = max(self.__next, int(np.searchsorted(times, now, side="left")))
+        end = max(start, int(np.searchsorted(times, now, side="right")))
+        self.__next = end
+
+        for row in self.requests[start:end].tolist():
+            kind, dir, time_in_force, symbol, _, order_id, _, agent = row[:8]
+            price, size, expires_at = row[9:]
+            if kind == Journal.ORDER:
+                order = Order(
+                    self.replayed_agents[agent],
+                    self.reader.symbols[symbol],
+                    dir,
+                    None if np.isnan(price) else price,
+                    size,
+                    self.exchange,
+                    None if expires_at < 0 else expires_at - now - 1,
+                    time_in_force,
+                )
+                self.replayed_orders[order_id] = order
+                self.exchange.place_order(order)
+                continue
+
+            order = self.replayed_orders.get(order_id, None)
+            if order is None:
+                continue
+            if kind == Journal.CANCEL:
+                self.exchange.cancel_order(order)
+            else:
+                self.exchange.amend_order(
+                    order,
+                    None if np.isnan(price) else price,
+                    None if size < 0 else size,
+                    None
+                    if expires_at < 0
+                    or expires_at + self.__offset == order.expires_at
+                    else expires_at - now - 1,
+                )
@@ -0,0 +1,28 @@
+from typing import Tuple
+import numpy as np
+
+
+def clearing_price(
+    bid_prices: np.ndarray,
+    bid_sizes: np.ndarray,
+    ask_prices: np.ndarray,
+    ask_sizes: np.ndarray,
+) -> Tuple[float, int]:
+    # Uniform clearing price of a call auction over price levels, bids best
+    # (highest) first and asks best (lowest) first. Every level price is a
+    # candidate; the winner maximises executed volume, then minimises the
+    # leftover imbalance, and the middle candidate breaks any remaining tie.
+    candidates = np.unique(np.concatenate((bid_prices, ask_prices)))
+
+    cum_bids = np.concatenate(([0], np.cumsum(bid_sizes)))
+    cum_asks = np.concatenate(([0], np.cumsum(ask_sizes)))
+    demand = cum_bids[np.searchsorted(-bid_prices, -candidates, side="right")]
+    supply = cum_asks[np.searchsorted(ask_prices, candidates, side="right")]
+
+    volume = np.minimum(demand, supply)
+    imbalance = np.abs(demand - supply)
+    best = volume == volume.max()
+    best &= imbalance == imbalance[best].min()
+    winners = np.flatnonzero(best)
+    winner = winners[(len(winners) - 1) // 2]
+    return float(candidates[winner]), int(volume[winner])
@@ -0,0 +1,86 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple, Union, TYPE_CHECKING
+from collections import namedtuple
+
+if TYPE_CHECKING:
+    from trading_objects import Exchange
+
+
+class BookDelta(
+    namedtuple(
+        "BookDelta", ["symbol", "seq", "action", "dir", "price", "size", "count"]
+    )
+):
+    # One change to the aggregated levels of a book. size and count are the
+    # new totals of the level (zero for DELETE). TRADE deltas carry the trade
+    # price and size and have no dir or count.
+    __slots__ = ()
+
+    ADD = 0
+    UPDATE = 1
+    DELETE = 2
+    TRADE = 3
+
+
+# bids and asks are lists of (price, size, count), best level first
+BookSnapshot = namedtuple("BookSnapshot", ["symbol", "seq", "bids", "asks"])
+
+
+class LocalOrderBook:
+    # Level book kept up to date from an exchange's delta feed. A gap in the
+    # sequence numbers marks the book stale until it is recovered.
+
+    def __init__(self, symbol: str) -> None:
+        self.symbol = symbol.upper()
+        self.seq = None
+        self.bids: Dict[float, Tuple[int, int]] = {}
+        self.asks: Dict[float, Tuple[int, int]] = {}
+        self.last_trade: Union[Tuple[float, int], None] = None
+
+    def load(self, snapshot: BookSnapshot) -> None:
+        self.seq = snapshot.seq
+        self.bids = {price: (size, count) for price, size, count in snapshot.bids}
+        self.asks = {price: (size, count) for price, size, count in snapshot.asks}
+
+    def apply(self, delta: BookDelta) -> bool:
+        if delta.symbol != self.symbol:
+            return True
+        if self.seq is not None and delta.seq <= self.seq:
+            # Already in the snapshot this book was recovered from
+            return True
+        if self.seq is None or delta.seq != self.seq + 1:
+            self.seq = None
+            return False
+        self.seq = delta.seq
+        if delta.action == BookDelta.TRADE:
+            self.last_trade = delta.price, delta.size
+            return True
+        levels = self.bids if delta.dir == 1 else self.asks
+        if delta.action == BookDelta.DELETE:
+            levels.pop(delta.price, None)
+        else:
+            levels[delta.price] = delta.size, delta.count
+        return True
+
+    def recover(self, exchange: Exchange) -> None:
+        snapshot, deltas = exchange.recover_book(self.symbol, self.seq)
+        if snapshot is not None:
+            self.load(snapshot)
+        for delta in deltas:
+            self.apply(delta)
+
+    def stale(self) -> bool:
+        return self.seq is None
+
+    def best_bid(self) -> Union[float, None]:
+        return max(self.bids) if len(self.bids) > 0 else None
+
+    def best_ask(self) -> Union[float, None]:
+        return min(self.asks) if len(self.asks) > 0 else None
+
+    def levels(self, dir: int) -> List[Tuple[float, int, int]]:
+        levels = self.bids if dir == 1 else self.asks
+        return [
+            (price, *levels[price])
+            for price in sorted(levels, key=lambda price: -dir * price)
+        ]
@@ -0,0 +1,23 @@
+from __future__ import annotations
+from typing import Dict, Iterator, TYPE_CHECKING
+from collections.abc import Mapping
+
+if TYPE_CHECKING:
+    from trading_objects import OrderBook
+
+
+class ExchangeView(Mapping):
+    # Symbol -> OrderBook.PublicInfo for every book of an exchange. Each book
+    # builds its snapshot on first access and shares it until it changes.
+
+    def __init__(self, order_books: Dict[str, OrderBook]) -> None:
+        self.__order_books = order_books
+
+    def __getitem__(self, symbol: str) -> OrderBook.PublicInfo:
+        return self.__order_books[symbol].public_info()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__order_books)
+
+    def __len__(self) -> int:
+        return len(self.__order_books)
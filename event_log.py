@@ -0,0 +1,100 @@
+from typing import Dict, List, Tuple, Union
+import numpy as np
+
+
+class EventLog:
+    # Fixed-size ring buffer of exchange events stored as rows of a structured
+    # array. Every event gets a sequence number, and readers keep their own
+    # cursor (the next sequence number they want) instead of copying events
+    # as they arrive. Once the log wraps, the oldest events are overwritten
+    # and a reader that falls behind skips ahead to the oldest one kept.
+    DTYPE = np.dtype(
+        [
+            ("seq", np.int64),
+            ("time", np.int64),
+            ("symbol", np.int32),
+            ("event_type", np.int8),
+            ("price", np.float64),
+            ("size", np.int64),
+            ("order_id", np.int64),
+        ]
+    )
+
+    def __init__(self, capacity: int) -> None:
+        self.__rows = np.zeros(capacity, dtype=EventLog.DTYPE)
+        self.__first = 0
+        self.__end = 0
+        self.__symbols: List[str] = []
+        self.__symbol_ids: Dict[str, int] = {}
+
+    @property
+    def capacity(self) -> int:
+        return len(self.__rows)
+
+    @property
+    def start(self) -> int:
+        return max(self.__end - len(self.__rows), self.__first)
+
+    @property
+    def end(self) -> int:
+        return self.__end
+
+    def symbol(self, symbol_id: int) -> str:
+        return self.__symbols[symbol_id]
+
+    def append(
+        self,
+        time: int,
+        symbol: str,
+        event_type: int,
+        price: Union[float, None],
+        size: int,
+        order_id: Union[int, None],
+    ) -> None:
+        symbol_id = self.__symbol_ids.get(symbol, None)
+        if symbol_id is None:
+            symbol_id = len(self.__symbols)
+            self.__symbols.append(symbol)
+            self.__symbol_ids[symbol] = symbol_id
+        self.__rows[self.__end % len(self.__rows)] = (
+            self.__end,
+            time,
+            symbol_id,
+            event_type,
+            np.nan if price is None else price,
+            size,
+            -1 if order_id is None else order_id,
+        )
+        self.__end += 1
+
+    def read(
+        self, cursor: int, limit: Union[int, None] = None
+    ) -> Tuple[np.ndarray, int]:
+        # Events from cursor on, oldest first, and the cursor to read from
+        # next. Unless the range wraps around, the rows are a view into the log
+        # and only stay valid until they are overwritten.
+        start = max(cursor, self.start)
+        end = self.__end if limit is None else min(self.__end, start + limit)
+        if start >= end:
+            return self.__rows[:0], start
+        first = start % len(self.__rows)
+        last = first + end - start
+        if last <= len(self.__rows):
+            return self.__rows[first:last], end
+        return (
+            np.concatenate(
+                (self.__rows[first:], self.__rows[: last - len(self.__rows)])
+            ),
+            end,
+        )
+
+    def latest(self, n: int) -> np.ndarray:
+        return self.read(self.__end - n)[0]
+
+    def grow(self, capacity: int) -> None:
+        if capacity <= len(self.__rows):
+            return
+        self.__first = self.start
+        rows, _ = self.read(self.__first)
+        self.__rows = np.zeros(capacity, dtype=EventLog.DTYPE)
+        self.__rows[rows["seq"] % capacity] = rows
@@ -0,0 +1,305 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple, Union, TYPE_CHECKING
+from collections import namedtuple
+import json
+import numpy as np
+
+if TYPE_CHECKING:
+    from trading_objects import Order
+
+
+# One resting order of a rebuilt book
+JournalOrder = namedtuple(
+    "JournalOrder", ["order_id", "agent", "dir", "price", "size", "expires_at"]
+)
+
+
+class Journal:
+    # Append-only record of everything that happens on an exchange, written as
+    # fixed-width rows to a memory-mapped file that doubles in size as it
+    # fills. ORDER, CANCEL and AMEND are the requests agents made. REST,
+    # FILL, REMOVE and REDUCE are what they did to the resting orders of a
+    # book. Every keyframe_interval ticks each book is written out whole, a
+    # KEYFRAME row followed by one KEY_ORDER row per resting order in priority
+    # order, so JournalReader can rebuild any tick from the nearest keyframe.
+    # Symbol and agent names, the row count, the tick size and the tick the
+    # recording started at live in a JSON sidecar.
+    ORDER = 0
+    CANCEL = 1
+    AMEND = 2
+    REST = 3
+    FILL = 4
+    REMOVE = 5
+    REDUCE = 6
+    KEYFRAME = 7
+    KEY_ORDER = 8
+
+    # Unset integer fields are -1 and unset prices NaN. A FILL has the bid in
+    # order_id and agent and the ask in other_id and other_agent; a KEYFRAME
+    # has its number of KEY_ORDER rows in size.
+    DTYPE = np.dtype(
+        [
+            ("kind", np.int8),
+            ("dir", np.int8),
+            ("time_in_force", np.int8),
+            ("symbol", np.int32),
+            ("time", np.int64),
+            ("order_id", np.int64),
+            ("other_id", np.int64),
+            ("agent", np.int32),
+            ("other_agent", np.int32),
+            ("price", np.float64),
+            ("size", np.int64),
+            ("expires_at", np.int64),
+        ]
+    )
+
+    def __init__(
+        self,
+        path: str,
+        keyframe_interval: int = 1000,
+        capacity: int = 1 << 16,
+        tick_size: float = 0.01,
+        start_time: int = 0,
+    ) -> None:
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.tick_size = tick_size
+        self.start_time = start_time
+        self.__rows = np.memmap(path, dtype=Journal.DTYPE, mode="w+", shape=capacity)
+        self.__size = 0
+        self.__symbols: List[str] = []
+        self.__symbol_ids: Dict[str, int] = {}
+        self.__agents: List[str] = []
+        self.__agent_ids: Dict[str, int] = {}
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        return f"{path}.json"
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def __name_id(self, name: str, names: List[str], ids: Dict[str, int]) -> int:
+        name_id = ids.get(name, None)
+        if name_id is None:
+            name_id = len(names)
+            names.append(name)
+            ids[name] = name_id
+        return name_id
+
+    def __append(
+        self,
+        kind: int,
+        time: int,
+        symbol: str,
+        order_id: int = -1,
+        agent: Union[str, None] = None,
+        dir: int = 0,
+        price: Union[float, None] = None,
+        size: Union[int, None] = None,
+        expires_at: Union[int, None] = None,
+        time_in_force: int = -1,
+        other_id: int = -1,
+        other_agent: Union[str, None] = None,
+    ) -> None:
+        if self.__size == len(self.__rows):
+            self.__rows.flush()
+            self.__rows = np.memmap(
+                self.path, dtype=Journal.DTYPE, mode="r+", shape=2 * len(self.__rows)
+            )
+        self.__rows[self.__size] = (
+            kind,
+            dir,
+            time_in_force,
+            self.__name_id(symbol, self.__symbols, self.__symbol_ids),
+            time,
+            order_id,
+            other_id,
+            -1
+            if agent is None
+            else self.__name_id(agent, self.__agents, self.__agent_ids),
+            -1
+            if other_agent is None
+            else self.__name_id(other_agent, self.__agents, self.__agent_ids),
+            np.nan if price is None else price,
+            -1 if size is None else size,
+            -1 if expires_at is None else expires_at,
+        )
+        self.__size += 1
+
+    def order(self, time: int, order: Order) -> None:
+        self.__append(
+            Journal.ORDER,
+            time,
+            order.symbol,
+            order.id,
+            order.sender.global_id,
+            order.dir,
+            order.price,
+            order.size,
+            order.expires_at,
+            order.time_in_force,
+        )
+
+    def cancel(self, time: int, order: Order) -> None:
+        self.__append(Journal.CANCEL, time, order.symbol, order.id)
+
+    def amend(
+        self,
+        time: int,
+        order: Order,
+        price: Union[float, None],
+        size: Union[int, None],
+        expires_at: Union[int, None],
+    ) -> None:
+        self.__append(
+            Journal.AMEND,
+            time,
+            order.symbol,
+            order.id,
+            price=price,
+            size=size,
+            expires_at=expires_at,
+        )
+
+    def rest(self, time: int, order: Order) -> None:
+        self.__append(
+            Journal.REST,
+            time,
+            order.symbol,
+            order.id,
+            order.sender.global_id,
+            order.dir,
+            order.price,
+            order.size,
+            order.expires_at,
+        )
+
+    def fill(self, time: int, bid: Order, ask: Order, price: float, size: int) -> None:
+        self.__append(
+            Journal.FILL,
+            time,
+            bid.symbol,
+            bid.id,
+            bid.sender.global_id,
+            price=price,
+            size=size,
+            other_id=ask.id,
+            other_agent=ask.sender.global_id,
+        )
+
+    def remove(self, time: int, order: Order) -> None:
+        self.__append(Journal.REMOVE, time, order.symbol, order.id)
+
+    def reduce(self, time: int, order: Order) -> None:
+        self.__append(Journal.REDUCE, time, order.symbol, order.id, size=order.size)
+
+    def keyframe(self, time: int, symbol: str, orders: List[Order]) -> None:
+        self.__append(Journal.KEYFRAME, time, symbol, size=len(orders))
+        for order in orders:
+            self.__append(
+                Journal.KEY_ORDER,
+                time,
+                symbol,
+                order.id,
+                order.sender.global_id,
+                order.dir,
+                order.price,
+                order.size,
+                order.expires_at,
+            )
+
+    def flush(self) -> None:
+        self.__rows.flush()
+        with open(Journal.sidecar_path(self.path), "w") as f:
+            json.dump(
+                {
+                    "rows": self.__size,
+                    "keyframe_interval": self.keyframe_interval,
+                    "tick_size": self.tick_size,
+                    "start_time": self.start_time,
+                    "symbols": self.__symbols,
+                    "agents": self.__agents,
+                },
+                f,
+            )
+
+
+class JournalReader:
+    def __init__(self, path: str) -> None:
+        with open(Journal.sidecar_path(path)) as f:
+            header = json.load(f)
+        self.symbols: List[str] = header["symbols"]
+        self.agents: List[str] = header["agents"]
+        self.keyframe_interval: int = header["keyframe_interval"]
+        self.tick_size: float = header.get("tick_size", 0.01)
+        self.start_time: int = header.get("start_time", 0)
+        self.rows = np.memmap(
+            path, dtype=Journal.DTYPE, mode="r", shape=header["rows"]
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def rows_through(self, time: int) -> int:
+        # Number of rows written up to the end of tick time
+        return int(np.searchsorted(self.rows["time"], time, side="right"))
+
+    def book_at(
+        self, symbol: str, time: int
+    ) -> Tuple[List[JournalOrder], List[JournalOrder]]:
+        # Resting bids and asks of symbol at the end of tick time, best first
+        if symbol not in self.symbols:
+            return [], []
+        symbol_id = self.symbols.index(symbol)
+        end = self.rows_through(time)
+        rows = self.rows[:end]
+
+        keyframes = np.flatnonzero(
+            (rows["kind"] == Journal.KEYFRAME) & (rows["symbol"] == symbol_id)
+        )
+        orders = {}
+        start = 0
+        if len(keyframes) > 0:
+            start = int(keyframes[-1])
+            count = int(rows["size"][start])
+            for row in rows[start + 1 : start + 1 + count].tolist():
+                orders[row[5]] = self.__order(row)
+            start += 1 + count
+
+        for row in rows[start:][rows["symbol"][start:] == symbol_id].tolist():
+            kind, order_id = row[0], row[5]
+            if kind == Journal.REST:
+                orders[order_id] = self.__order(row)
+            elif kind == Journal.REMOVE:
+                orders.pop(order_id, None)
+            elif kind == Journal.REDUCE:
+                if order_id in orders:
+                    orders[order_id] = orders[order_id]._replace(size=row[10])
+            elif kind == Journal.FILL:
+                for filled_id in (order_id, row[6]):
+                    order = orders.get(filled_id, None)
+                    if order is None:
+                        continue
+                    if order.size > row[10]:
+                        orders[filled_id] = order._replace(size=order.size - row[10])
+                    else:
+                        del orders[filled_id]
+
+        # orders keeps the arrival order, which is the queue order in a level
+        bids = [order for order in orders.values() if order.dir == 1]
+        asks = [order for order in orders.values() if order.dir == -1]
+        bids.sort(key=lambda order: -order.price)
+        asks.sort(key=lambda order: order.price)
+        return bids, asks
+
+    def __order(self, row: tuple) -> JournalOrder:
+        return JournalOrder(
+            row[5],
+            self.agents[row[7]],
+            row[1],
+            row[9],
+            row[10],
+            None if row[11] < 0 else row[11],
+        )
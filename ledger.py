@@ -0,0 +1,312 @@
+from typing import Dict, List
+import numpy as np
+
+
+class Ledger:
+    # Holdings of every account on an exchange, one row per agent and one
+    # column per symbol, with cash kept in its own vector. Rows and columns are
+    # added on first use and the arrays grow by doubling, so whole-market
+    # operations like marking to market are single array ops.
+    #
+    # Per-share payments such as dividends and coupons only move a per-symbol
+    # accrual index, the total paid per share so far. Each account remembers
+    # the index it last settled at and is credited the difference when its
+    # position changes or its cash is read, so a payment is O(1) however many
+    # accounts hold the symbol.
+    #
+    # Long and short open interest, the sums of the positive and negative
+    # positions of each symbol, are kept up to date on every position change.
+    #
+    # Each position also carries its cost basis at average cost, and each
+    # account its realized PnL from trading: a trade that adds to a position
+    # adds to its cost, one that reduces it realizes the difference to the
+    # average price. Dividends and coupons go to cash, not realized PnL.
+
+    def __init__(self, capacity: int = 64, num_symbols: int = 8) -> None:
+        self.__rows: Dict[str, int] = {}
+        self.__columns: Dict[str, int] = {}
+        self.__positions = np.zeros((capacity, num_symbols), dtype=np.int64)
+        self.__cash = np.zeros(capacity, dtype=np.float64)
+        self.__index = np.zeros(num_symbols, dtype=np.float64)
+        self.__settled = np.zeros((capacity, num_symbols), dtype=np.float64)
+        self.__long = [0] * num_symbols
+        self.__short = [0] * num_symbols
+        self.__cost = np.zeros((capacity, num_symbols), dtype=np.float64)
+        self.__realized = np.zeros(capacity, dtype=np.float64)
+
+    def add_account(self, agent_id: str) -> int:
+        row = self.__rows.get(agent_id, None)
+        if row is None:
+            row = len(self.__rows)
+            if row == len(self.__cash):
+                self.__positions = np.concatenate(
+                    (self.__positions, np.zeros_like(self.__positions))
+                )
+                self.__cash = np.concatenate((self.__cash, np.zeros_like(self.__cash)))
+                self.__settled = np.concatenate(
+                    (self.__settled, np.zeros_like(self.__settled))
+                )
+                self.__cost = np.concatenate((self.__cost, np.zeros_like(self.__cost)))
+                self.__realized = np.concatenate(
+                    (self.__realized, np.zeros_like(self.__realized))
+                )
+            self.__rows[agent_id] = row
+        return row
+
+    def add_symbol(self, symbol: str) -> int:
+        column = self.__columns.get(symbol, None)
+        if column is None:
+            column = len(self.__columns)
+            if column == self.__positions.shape[1]:
+                self.__positions = np.concatenate(
+                    (self.__positions, np.zeros_like(self.__positions)), axis=1
+                )
+                self.__settled = np.concatenate(
+                    (self.__settled, np.zeros_like(self.__settled)), axis=1
+                )
+                self.__cost = np.concatenate(
+                    (self.__cost, np.zeros_like(self.__cost)), axis=1
+                )
+                self.__index = np.concatenate(
+                    (self.__index, np.zeros_like(self.__index))
+                )
+                self.__long.extend([0] * len(self.__long))
+                self.__short.extend([0] * len(self.__short))
+            self.__columns[symbol] = column
+        return column
+
+    def row(self, agent_id: str) -> int:
+        return self.__rows[agent_id]
+
+    def column(self, symbol: str) -> int:
+        return self.__columns.get(symbol, -1)
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self.__columns)
+
+    @property
+    def agent_ids(self) -> List[str]:
+        return list(self.__rows)
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.__positions[: len(self.__rows), : len(self.__columns)]
+
+    @property
+    def cash(self) -> np.ndarray:
+        self.__settle_all()
+        return self.__cash[: len(self.__rows)]
+
+    def __move(self, row: int, column: int, val: int) -> None:
+        # Set a position, keeping the open interest of its symbol in step
+        old = int(self.__positions[row, column])
+        self.__long[column] += max(val, 0) - max(old, 0)
+        self.__short[column] += max(-val, 0) - max(-old, 0)
+        self.__positions[row, column] = val
+
+    def __book_trade(
+        self, row: int, column: int, quantity: int, price: float, position: int
+    ) -> None:
+        # Cost basis and realized PnL of buying quantity (selling if negative)
+        # at price, out of position
+        cost = self.__cost[row, column]
+        if position == 0 or (position > 0) == (quantity > 0):
+            self.__cost[row, column] = cost + quantity * price
+            return
+        average = cost / position
+        closed = min(abs(quantity), abs(position))
+        direction = 1 if position > 0 else -1
+        self.__realized[row] += closed * direction * (price - average)
+        new_position = position + quantity
+        if new_position == 0:
+            self.__cost[row, column] = 0
+        elif (new_position > 0) == (position > 0):
+            self.__cost[row, column] = average * new_position
+        else:
+            self.__cost[row, column] = new_position * price
+
+    def __rescale_cost(self, row: int, column: int, val: int) -> None:
+        # Positions changed other than by trading keep their average cost
+        position = int(self.__positions[row, column])
+        if position == 0:
+            self.__cost[row, column] = 0
+        else:
+            self.__cost[row, column] *= val / position
+
+    def __settle(self, row: int, column: int) -> None:
+        accrued = self.__index[column] - self.__settled[row, column]
+        if accrued != 0:
+            self.__cash[row] += self.__positions[row, column] * accrued
+            self.__settled[row, column] = self.__index[column]
+
+    def __settle_row(self, row: int) -> None:
+        n = len(self.__columns)
+        accrued = self.__index[:n] - self.__settled[row, :n]
+        if accrued.any():
+            self.__cash[row] += self.__positions[row, :n] @ accrued
+            self.__settled[row, :n] = self.__index[:n]
+
+    def __settle_column(self, column: int) -> None:
+        m = len(self.__rows)
+        accrued = self.__index[column] - self.__settled[:m, column]
+        self.__cash[:m] += self.__positions[:m, column] * accrued
+        self.__settled[:m, column] = self.__index[column]
+
+    def __settle_all(self) -> None:
+        m = len(self.__rows)
+        n = len(self.__columns)
+        accrued = self.__index[:n] - self.__settled[:m, :n]
+        self.__cash[:m] += (self.__positions[:m, :n] * accrued).sum(axis=1)
+        self.__settled[:m, :n] = self.__index[:n]
+
+    def get_position(self, row: int, symbol: str) -> int:
+        column = self.__columns.get(symbol, -1)
+        if column < 0:
+            return 0
+        return int(self.__positions[row, column])
+
+    def set_position(self, row: int, symbol: str, val: int) -> None:
+        column = self.add_symbol(symbol)
+        self.__settle(row, column)
+        self.__rescale_cost(row, column, val)
+        self.__move(row, column, val)
+
+    def add_position(self, row: int, symbol: str, val: int) -> None:
+        column = self.add_symbol(symbol)
+        val += int(self.__positions[row, column])
+        self.__settle(row, column)
+        self.__rescale_cost(row, column, val)
+        self.__move(row, column, val)
+
+    def get_cash(self, row: int) -> float:
+        self.__settle_row(row)
+        return float(self.__cash[row])
+
+    def set_cash(self, row: int, val: float) -> None:
+        self.__settle_row(row)
+        self.__cash[row] = val
+
+    def add_cash(self, row: int, val: float) -> None:
+        self.__cash[row] += val
+
+    def settle(
+        self, buyer_row: int, seller_row: int, symbol: str, price: float, size: int
+    ) -> None:
+        column = self.add_symbol(symbol)
+        self.__settle(buyer_row, column)
+        self.__settle(seller_row, column)
+        buyer_position = int(self.__positions[buyer_row, column])
+        self.__book_trade(buyer_row, column, size, price, buyer_position)
+        self.__cash[buyer_row] -= price * size
+        self.__move(buyer_row, column, buyer_position + size)
+        seller_position = int(self.__positions[seller_row, column])
+        self.__book_trade(seller_row, column, -size, price, seller_position)
+        self.__cash[seller_row] += price * size
+        self.__move(seller_row, column, seller_position - size)
+
+    def settle_batch(
+        self,
+        buyer_rows: np.ndarray,
+        seller_rows: np.ndarray,
+        columns: np.ndarray,
+        prices: np.ndarray,
+        sizes: np.ndarray,
+    ) -> None:
+        # Settle many trades at once, in order. Cash moves are interleaved so
+        # every account sees the same sequence of additions as settling the
+        # trades one by one.
+        m = len(self.__rows)
+        traded_columns = np.unique(columns)
+        for column in traded_columns:
+            self.__settle_column(column)
+
+        # Cost basis depends on the order of the trades, so it is booked one
+        # trade at a time against running positions
+        running = {}
+        for buyer_row, seller_row, column, price, size in zip(
+            buyer_rows.tolist(),
+            seller_rows.tolist(),
+            columns.tolist(),
+            prices.tolist(),
+            sizes.tolist(),
+        ):
+            for row, quantity in ((buyer_row, size), (seller_row, -size)):
+                position = running.get((row, column), None)
+                if position is None:
+                    position = int(self.__positions[row, column])
+                self.__book_trade(row, column, quantity, price, position)
+                running[(row, column)] = position + quantity
+
+        notional = prices * sizes
+        rows = np.empty(2 * len(buyer_rows), dtype=np.int64)
+        rows[0::2] = buyer_rows
+        rows[1::2] = seller_rows
+        amounts = np.empty(2 * len(notional), dtype=np.float64)
+        amounts[0::2] = -notional
+        amounts[1::2] = notional
+        np.add.at(self.__cash, rows, amounts)
+        np.add.at(self.__positions, (buyer_rows, columns), sizes)
+        np.subtract.at(self.__positions, (seller_rows, columns), sizes)
+
+        for column in traded_columns:
+            positions = self.__positions[:m, column]
+            self.__long[column] = int(positions[positions > 0].sum())
+            self.__short[column] = int(-positions[positions < 0].sum())
+
+    def accrue(self, symbol: str, amount: float) -> None:
+        # Pay amount per share held of symbol to every account
+        column = self.add_symbol(symbol)
+        self.__index[column] += amount
+
+    def close_out(self, symbol: str, price: float) -> None:
+        # Pay every holder price per share and zero the position
+        column = self.__columns.get(symbol, -1)
+        if column >= 0:
+            m = len(self.__rows)
+            self.__settle_column(column)
+            self.__cash[:m] += self.__positions[:m, column] * price
+            self.__realized[:m] += (
+                self.__positions[:m, column] * price - self.__cost[:m, column]
+            )
+            self.__cost[:m, column] = 0
+            self.__positions[:m, column] = 0
+            self.__long[column] = 0
+            self.__short[column] = 0
+
+    def long_interest(self, symbol: str) -> int:
+        column = self.__columns.get(symbol, -1)
+        return self.__long[column] if column >= 0 else 0
+
+    def short_interest(self, symbol: str) -> int:
+        column = self.__columns.get(symbol, -1)
+        return self.__short[column] if column >= 0 else 0
+
+    def cost_basis(self, row: int, symbol: str) -> float:
+        column = self.__columns.get(symbol, -1)
+        return float(self.__cost[row, column]) if column >= 0 else 0
+
+    def realized(self, row: int) -> float:
+        return float(self.__realized[row])
+
+    def total_position(self, row: int) -> int:
+        return int(self.__positions[row, : len(self.__columns)].sum())
+
+    def exposure(self, row: int, marks: np.ndarray) -> float:
+        # Net value of the positions of an account marked at marks
+        return float(self.__positions[row, : len(self.__columns)] @ marks)
+
+    def unrealized(self, row: int, marks: np.ndarray) -> float:
+        n = len(self.__columns)
+        return float(
+            self.__positions[row, :n] @ marks - self.__cost[row, :n].sum()
+        )
+
+    def marked_values(self, marks: np.ndarray) -> np.ndarray:
+        # Cash plus every position marked at marks, one entry per account
+        return self.cash + self.positions @ marks
+
+    def marked_value(self, row: int, marks: np.ndarray) -> float:
+        self.__settle_row(row)
+        positions = self.__positions[row, : len(self.__columns)]
+        return float(self.__cash[row] + positions @ marks)
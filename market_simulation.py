@@ -5,17 +5,18 @@ matplotlib.use("Agg")
 import os
 import shutil
 
-from typing import Union, List, Callable, Dict, Any
+from typing import Union, List, Callable, Dict, Any, Self
 
 import threading
 import numpy as np
 import matplotlib.pyplot as plt
 import json
 
-from simulation import Simulation
+from simulation import Simulation, Time
 from trading_objects import Agent, Exchange, Product, Account
-from agents import SingleProductFixedAgent, ManualAgent
+from agents import SingleProductFixedAgent, ManualAgent, ReplayAgent
 from metrics import MetricsAggregator, MetricsPlots
+from nbbo import NBBO
 
 
 class MarketSimulation(Simulation):
@@ -51,11 +52,43 @@ class MarketSimulation(Simulation):
                 exchange.register_product(product)
             for agent in agents:
                 exchange.register_agent(agent)
+        # Consolidated quotes for routing orders between exchanges
+        self.nbbo = NBBO(exchanges) if len(exchanges) > 1 else None
+        if self.nbbo is not None:
+            for agent in agents:
+                agent.nbbo = self.nbbo
         simulation_objs = exchanges + agents
         if self.metrics_aggregator is not None:
             simulation_objs.append(self.metrics_aggregator)
         super().__init__(dt, iter, lock, simulation_objs)
 
+    @classmethod
+    def replay(
+        cls,
+        journal_path: str,
+        agents: List[Agent] = [],
+        products: Union[List[Product], None] = None,
+        exchange: Union[Exchange, None] = None,
+        **kwargs,
+    ) -> Self:
+        # Simulation of live agents trading against the flow recorded in a
+        # journal, run unpaced through the last recorded tick by default.
+        # Products default to plain Products for the recorded symbols and the
+        # exchange to one with the recorded tick size.
+        replay_agent = ReplayAgent(journal_path)
+        if products is None:
+            products = [Product(symbol) for symbol in replay_agent.reader.symbols]
+        kwargs.setdefault("dt", 0)
+        kwargs.setdefault("iter", Time.now + replay_agent.num_ticks)
+        if exchange is None:
+            exchange = Exchange(tick_size=replay_agent.reader.tick_size)
+        return cls(
+            exchanges=exchange,
+            agents=[replay_agent] + agents,
+            products=products,
+            **kwargs,
+        )
+
     def update(self) -> None:
         super().update()
         if self.display_to_console:
@@ -0,0 +1,59 @@
+from typing import Tuple
+import numpy as np
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def match_dense(
+    bid_ticks: np.ndarray,
+    bid_sizes: np.ndarray,
+    bid_times: np.ndarray,
+    ask_ticks: np.ndarray,
+    ask_sizes: np.ndarray,
+    ask_times: np.ndarray,
+    bid_level_sizes: np.ndarray,
+    ask_level_sizes: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Price-time matching of the crossed orders of a dense book, each side in
+    # priority order with its orders' ticks, sizes and queue timestamps. The
+    # aggregate sizes of the levels, bid_level_sizes and ask_level_sizes, are
+    # reduced in place. Returns the bid index, ask index, whether the bid set
+    # the price and the size of every fill in the order they happen. Trades
+    # are priced by the order that took its place in the queue first, the bid
+    # on a tie, exactly like OrderBook.__match_orders.
+    n = len(bid_ticks) + len(ask_ticks)
+    bid_idx = np.empty(n, dtype=np.int64)
+    ask_idx = np.empty(n, dtype=np.int64)
+    bid_priced = np.empty(n, dtype=np.bool_)
+    sizes = np.empty(n, dtype=np.int64)
+    bid_left = bid_sizes.copy()
+    ask_left = ask_sizes.copy()
+
+    i = 0
+    j = 0
+    k = 0
+    while i < len(bid_ticks) and j < len(ask_ticks) and bid_ticks[i] >= ask_ticks[j]:
+        size = min(bid_left[i], ask_left[j])
+        bid_idx[k] = i
+        ask_idx[k] = j
+        bid_priced[k] = bid_times[i] <= ask_times[j]
+        sizes[k] = size
+        bid_left[i] -= size
+        ask_left[j] -= size
+        bid_level_sizes[bid_ticks[i]] -= size
+        ask_level_sizes[ask_ticks[j]] -= size
+        if bid_left[i] == 0:
+            i += 1
+        if ask_left[j] == 0:
+            j += 1
+        k += 1
+    return bid_idx[:k], ask_idx[:k], bid_priced[:k], sizes[:k]
+
+
+if NUMBA_AVAILABLE:
+    match_dense = njit(cache=True)(match_dense)
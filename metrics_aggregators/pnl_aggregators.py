@@ -19,12 +19,29 @@ class PnlAggregator(MetricsAggregator):
             self.mark_to_f_name = mark_to_f.__name__
 
     def snapshot(self) -> Dict[str, Any]:
+        # Mark every account of each exchange at once
+        exchanges = {}
+        for agent in self.agents:
+            for exchange in agent.exchanges.values():
+                exchanges[exchange.name] = exchange
+        pnls = {
+            name: exchanges[name].get_marked_pnls(self.mark_to_f)
+            for name in exchanges
+        }
+
         pnls_per_class = {}
         for agent in self.agents:
             if agent.__class__ not in pnls_per_class:
                 pnls_per_class[agent.__class__] = []
 
-            pnls_per_class[agent.__class__].append(agent.get_marked_pnl(marked_to=self.mark_to_f))
+            pnls_per_class[agent.__class__].append(
+                sum(
+                    [
+                        pnls[exchange.name][agent.global_id]
+                        for exchange in agent.exchanges.values()
+                    ]
+                )
+            )
 
         return (
             {
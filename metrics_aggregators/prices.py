@@ -12,46 +12,20 @@ class PriceAggregator(MetricsAggregator):
         self.products = products
 
     def snapshot(self) -> Dict[str, Any]:
-        order_books = self.exchange.public_info()
-
         metrics = {}
 
         for product in self.products:
             symbol = product.symbol
-
-            bids = order_books[symbol].bids
-            asks = order_books[symbol].asks
-
-            bid = None
-            bid_size = None
-            if len(bids) > 0:
-                bid = bids[-1].price
-                bid_size = bids[-1].size
-                cur_idx = 2
-                while len(bids) - cur_idx > -1 and bids[-cur_idx].price == bid:
-                    bid_size += bids[-cur_idx].size
-                    cur_idx += 1
-
-            ask = None
-            ask_size = None
-            if len(asks) > 0:
-                ask = asks[-1].price
-                ask_size = asks[-1].size
-                cur_idx = 2
-                while len(asks) - cur_idx > -1 and asks[-cur_idx].price == ask:
-                    ask_size += asks[-cur_idx].size
-                    cur_idx += 1
-
-            last_traded_price = None
-            if len(product.trades) > 0:
-                last_traded_price = product.trades[-1].price
+            top = self.exchange.top_of_book(symbol)
+            features = self.exchange.book_features(symbol)
 
             metrics = metrics | {
-                f"{symbol}_bid": bid,
-                f"{symbol}_bid_size": bid_size,
-                f"{symbol}_ask": ask,
-                f"{symbol}_ask_size": ask_size,
-                f"{symbol}_last_traded_price": last_traded_price,
+                f"{symbol}_bid": top.bid,
+                f"{symbol}_bid_size": None if top.bid is None else top.bid_size,
+                f"{symbol}_ask": top.ask,
+                f"{symbol}_ask_size": None if top.ask is None else top.ask_size,
+                f"{symbol}_last_traded_price": top.last_price,
+                f"{symbol}_microprice": features.microprice,
             }
 
         return metrics
@@ -64,10 +38,9 @@ class PricePlot(MetricsPlots):
             f"{symbol}_prices",
             [
                 f"{symbol}_bid",
-                f"{symbol}_bid_size",
                 f"{symbol}_ask",
-                f"{symbol}_ask_size",
                 f"{symbol}_last_traded_price",
+                f"{symbol}_microprice",
                 "time"
             ],
             self.price_plot,
@@ -75,20 +48,18 @@ class PricePlot(MetricsPlots):
 
     def price_plot(self, **kwargs):
         bid = kwargs[f"{self.symbol}_bid"]
-        bid_size = kwargs[f"{self.symbol}_bid_size"]
         ask = kwargs[f"{self.symbol}_ask"]
-        ask_size = kwargs[f"{self.symbol}_ask_size"]
         last_traded_price = kwargs[f"{self.symbol}_last_traded_price"]
+        microprice = kwargs[f"{self.symbol}_microprice"]
 
         times = kwargs["time"]
 
         mid = (bid + ask) / 2
-        swmid = (bid * ask_size + ask * bid_size) / (bid_size + ask_size)
 
         plt.plot(times, last_traded_price, label="last_traded_price", linewidth=1)
         plt.plot(times, bid, label="bid", linewidth=1)
         plt.plot(times, ask, label="ask", linewidth=1)
-        plt.plot(times, swmid, label="swmid", linewidth=1)
+        plt.plot(times, microprice, label="microprice", linewidth=1)
         plt.plot(times, mid, label="mid", linewidth=1)
 
         plt.xlabel("Time")
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, Tuple
 import numpy as np
 
 from trading_objects import Product, Time
@@ -99,3 +99,11 @@ class CorporateBond(Product):
         return (
             self.maturity > -1 and Time.now >= self.maturity
         ) or self.company_stock.bankrupt
+
+    def price_bounds(self) -> Tuple[float, float]:
+        if self.coupon_freq == 0:
+            return 0, self.par_value + self.coupon_payout
+        end_time = ITER if self.maturity == -1 else self.maturity
+        return 0, self.par_value + self.coupon_payout * (
+            end_time // self.coupon_freq + 1
+        )
@@ -1,6 +1,6 @@
 import numpy as np
 
-from trading_objects import Agent, Exchange, Event, Account
+from trading_objects import Agent, Exchange, Event, Order
 from .config import *
 
 
@@ -24,24 +24,19 @@ class RetailInvestor(Agent):
     def update(self) -> None:
         super().update()
 
-        order_books = self.exchange.public_info()
-
         cheapest_investment = None
-        for symbol in order_books:
+        for symbol in self.exchange.symbols:
+            top = self.exchange.top_of_book(symbol)
             if self.opinion == 1:
-                asks = order_books[symbol].asks
-                if len(asks) > 0 and (
-                    cheapest_investment is None
-                    or asks[-1].price < cheapest_investment[1]
+                if top.ask is not None and (
+                    cheapest_investment is None or top.ask < cheapest_investment[1]
                 ):
-                    cheapest_investment = symbol, asks[-1].price
+                    cheapest_investment = symbol, top.ask
             else:
-                bids = order_books[symbol].bids
-                if len(bids) > 0 and (
-                    cheapest_investment is None
-                    or bids[-1].price > cheapest_investment[1]
+                if top.bid is not None and (
+                    cheapest_investment is None or top.bid > cheapest_investment[1]
                 ):
-                    cheapest_investment = symbol, bids[-1].price
+                    cheapest_investment = symbol, top.bid
 
         if (
             cheapest_investment is not None
@@ -211,11 +206,11 @@ class HedgeFund(Agent):
 
     def register_exchange(self, exchange: Exchange) -> None:
         super().register_exchange(exchange)
-        exchange.subscribe(self, self.process_event)
+        exchange.subscribe(
+            self, self.process_event, event_types=[Event.BID, Event.ASK]
+        )
 
     def process_event(self, event: Event) -> None:
-        if event.event_type == Event.TRADE:
-            return
         if event.order_id in self.open_orders:
             return
 
@@ -323,13 +318,10 @@ class ArbAgent(Agent):
         self.resting_order_expiration_time = 2
 
     def get_total_holding(self) -> int:
-        self.holdings = self.exchange.get_account_holdings(self)
-        total_holding = sum(self.holdings.values()) - self.holdings[Account.CASH_SYM]
-        return total_holding
+        return self.exchange.get_total_holding(self)
 
     def close_positions(self) -> None:
         order_books = self.exchange.public_info()
-        self.holdings = self.exchange.get_account_holdings(self)
         total_holding = self.get_total_holding()
 
         if total_holding == 0:
@@ -372,21 +364,13 @@ class ArbAgent(Agent):
     def update(self) -> None:
         super().update()
 
-        order_books = self.exchange.public_info()
-
         markets = {}
 
-        for symbol in order_books:
-            bids = order_books[symbol].bids
-            asks = order_books[symbol].asks
+        for symbol in self.exchange.symbols:
+            top = self.exchange.top_of_book(symbol)
 
-            if len(bids) > 0 and len(asks) > 0:
-                markets[symbol] = (
-                    bids[-1].price,
-                    bids[-1].size,
-                    asks[-1].price,
-                    asks[-1].size,
-                )
+            if top.bid is not None and top.ask is not None:
+                markets[symbol] = (top.bid, top.bid_size, top.ask, top.ask_size)
 
         if len(markets) > 0:
             highest_bid_symbol = max(markets, key=lambda symbol: markets[symbol][0])
@@ -441,22 +425,20 @@ class MarketMaker(Agent):
         symbol: str | None = None,
         exchange_name: str | None = None,
         frames_to_expire: int | None = None,
+        time_in_force: int = Order.GTC,
     ) -> int:
         return super().limit_order(
-            dir, price, size, symbol, exchange_name, frames_to_expire
+            dir, price, size, symbol, exchange_name, frames_to_expire, time_in_force
         )
 
     def get_total_holding(self) -> int:
-        self.holdings = self.exchange.get_account_holdings(self)
-        total_holding = sum(self.holdings.values()) - self.holdings[Account.CASH_SYM]
-        return total_holding
+        return self.exchange.get_total_holding(self)
 
     def clip(self, x: float) -> float:
         return min(max(x, 0), MAX_PAYOUT)
 
     def close_positions(self) -> None:
         order_books = self.exchange.public_info()
-        self.holdings = self.exchange.get_account_holdings(self)
         total_holding = self.get_total_holding()
 
         if total_holding == 0:
@@ -497,7 +479,6 @@ class MarketMaker(Agent):
                 )
 
     def update_fair_value(self):
-        order_books = self.exchange.public_info()
         total_holding = self.get_total_holding()
 
         mult = 1
@@ -509,33 +490,18 @@ class MarketMaker(Agent):
                 - self.holding_adjustment_mult_range / 2
             )
 
-        for symbol in order_books:
+        for symbol in self.exchange.symbols:
             fair_estimators = []
 
-            bids = order_books[symbol].bids
-            asks = order_books[symbol].asks
-
-            if len(bids) > 0 and len(asks) > 0:
-                bid_prices = np.array([bid.price for bid in bids])
-                bid_sizes = np.array([bid.size for bid in bids])
-                ask_prices = np.array([ask.price for ask in asks])
-                ask_sizes = np.array([ask.size for ask in asks])
+            top = self.exchange.top_of_book(symbol)
 
-                spread = ask_prices[-1] - bid_prices[-1]
+            if top.bid is not None and top.ask is not None:
+                features = self.exchange.book_features(symbol)
+                spread = features.spread
 
-                mid = (bid_prices[-1] + ask_prices[-1]) / 2
+                mid = (top.bid + top.ask) / 2
                 fair_estimators.append(mid)
-
-                buy_side_mean = np.mean(bid_prices[-5:])
-                buy_side_volume = np.sum(bid_sizes[-5:])
-
-                sell_side_mean = np.mean(ask_prices[-5:])
-                sell_side_volume = np.sum(ask_sizes[-5:])
-
-                swmid = (
-                    buy_side_mean * sell_side_volume + sell_side_mean * buy_side_volume
-                ) / (buy_side_volume + sell_side_volume)
-                fair_estimators.append(swmid)
+                fair_estimators.append(features.depth_mid)
 
                 if spread <= self.tight_market_max_spread * TICK_SIZE:
                     self.tight_market_mids[symbol].append(mid)
@@ -556,38 +522,33 @@ class MarketMaker(Agent):
             asks = order_books[symbol].asks
 
             if len(bids) > 0 and len(asks) > 0:
-                bid_prices = np.array([bid.price for bid in bids])
-                ask_prices = np.array([ask.price for ask in asks])
-
-                spread = ask_prices[-1] - bid_prices[-1]
+                spread = asks[-1].price - bids[-1].price
 
                 edge = max(spread * 0.4, self.min_edge)
-                if not bids[-1].id in self.open_orders:
-                    self.bid(
-                        price=self.clip(self.fairs[symbol] - edge),
-                        size=self.sizing,
-                        symbol=symbol,
-                        frames_to_expire=self.resting_order_expiration_time,
-                    )
-                if not asks[-1].id in self.open_orders:
-                    self.ask(
-                        price=self.clip(self.fairs[symbol] + edge),
-                        size=self.sizing,
-                        symbol=symbol,
+                # Only the side that lost the touch is requoted
+                requote_bid = not bids[-1].id in self.open_orders
+                requote_ask = not asks[-1].id in self.open_orders
+                if requote_bid or requote_ask:
+                    self.quote(
+                        symbol,
+                        bid=self.clip(self.fairs[symbol] - edge)
+                        if requote_bid
+                        else None,
+                        bid_size=self.sizing,
+                        ask=self.clip(self.fairs[symbol] + edge)
+                        if requote_ask
+                        else None,
+                        ask_size=self.sizing,
                         frames_to_expire=self.resting_order_expiration_time,
                     )
 
             else:
-                self.bid(
-                    price=0,
-                    size=self.sizing,
-                    symbol=symbol,
-                    frames_to_expire=self.resting_order_expiration_time,
-                )
-                self.ask(
-                    price=MAX_PAYOUT,
-                    size=self.sizing,
-                    symbol=symbol,
+                self.quote(
+                    symbol,
+                    bid=0,
+                    bid_size=self.sizing,
+                    ask=MAX_PAYOUT,
+                    ask_size=self.sizing,
                     frames_to_expire=self.resting_order_expiration_time,
                 )
 
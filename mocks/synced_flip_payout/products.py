@@ -1,5 +1,7 @@
+from typing import Tuple
+
 from trading_objects import Product
-from .config import PAYOUT
+from .config import PAYOUT, MAX_PAYOUT
 
 class PairedFlipProduct(Product):
     def __init__(self, symbol: str) -> None:
@@ -7,3 +9,6 @@ class PairedFlipProduct(Product):
 
     def payout(self) -> float:
         return PAYOUT
+
+    def price_bounds(self) -> Tuple[float, float]:
+        return 0, MAX_PAYOUT
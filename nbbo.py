@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple, Union, TYPE_CHECKING
+from collections import namedtuple
+
+if TYPE_CHECKING:
+    from trading_objects import Exchange
+
+
+class NBBO:
+    # Best bid and offer of every symbol across several exchanges. Each
+    # exchange pushes the top of its books here whenever it changes, so the
+    # consolidated quote of a symbol is only recomputed, over its venues, when
+    # one of them moves, and reading it or routing an order is O(1). Sizes are
+    # summed over the venues at the best price and the venue is the first
+    # registered one there.
+    Quote = namedtuple(
+        "Quote", ["bid", "bid_size", "bid_exchange", "ask", "ask_size", "ask_exchange"]
+    )
+
+    def __init__(self, exchanges: List[Exchange] = []) -> None:
+        self.__exchanges: Dict[str, Exchange] = {}
+        # symbol -> exchange name -> (bid, bid size, ask, ask size)
+        self.__venues: Dict[str, Dict[str, Tuple]] = {}
+        self.__quotes: Dict[str, NBBO.Quote] = {}
+        for exchange in exchanges:
+            self.add_exchange(exchange)
+
+    def add_exchange(self, exchange: Exchange) -> None:
+        if exchange.name in self.__exchanges:
+            return
+        self.__exchanges[exchange.name] = exchange
+        for symbol in exchange.symbols:
+            top = exchange.top_of_book(symbol)
+            self.update(exchange, symbol, top.bid, top.bid_size, top.ask, top.ask_size)
+        exchange.subscribe_top(self.update)
+
+    def update(
+        self,
+        exchange: Exchange,
+        symbol: str,
+        bid: Union[float, None],
+        bid_size: int,
+        ask: Union[float, None],
+        ask_size: int,
+    ) -> None:
+        venues = self.__venues.setdefault(symbol, {})
+        venues[exchange.name] = (bid, bid_size, ask, ask_size)
+
+        best_bid, best_bid_size, bid_exchange = None, 0, None
+        best_ask, best_ask_size, ask_exchange = None, 0, None
+        for name, (venue_bid, venue_bid_size, venue_ask, venue_ask_size) in (
+            venues.items()
+        ):
+            if venue_bid is not None:
+                if best_bid is None or venue_bid > best_bid:
+                    best_bid, best_bid_size, bid_exchange = (
+                        venue_bid,
+                        venue_bid_size,
+                        name,
+                    )
+                elif venue_bid == best_bid:
+                    best_bid_size += venue_bid_size
+            if venue_ask is not None:
+                if best_ask is None or venue_ask < best_ask:
+                    best_ask, best_ask_size, ask_exchange = (
+                        venue_ask,
+                        venue_ask_size,
+                        name,
+                    )
+                elif venue_ask == best_ask:
+                    best_ask_size += venue_ask_size
+        self.__quotes[symbol] = NBBO.Quote(
+            best_bid,
+            best_bid_size,
+            None if bid_exchange is None else self.__exchanges[bid_exchange],
+            best_ask,
+            best_ask_size,
+            None if ask_exchange is None else self.__exchanges[ask_exchange],
+        )
+
+    def quote(self, symbol: str) -> NBBO.Quote:
+        quote = self.__quotes.get(symbol.upper(), None)
+        if quote is None:
+            return NBBO.Quote(None, 0, None, None, 0, None)
+        return quote
+
+    def route(
+        self, symbol: str, dir: int, price: Union[float, None]
+    ) -> Union[Exchange, None]:
+        # The venue showing the best opposite price when the order would take
+        # it, otherwise the one showing the best price on the order's side
+        quote = self.quote(symbol)
+        if dir == 1:
+            if quote.ask is not None and (price is None or price >= quote.ask):
+                return quote.ask_exchange
+            return quote.bid_exchange
+        if quote.bid is not None and (price is None or price <= quote.bid):
+            return quote.bid_exchange
+        return quote.ask_exchange
@@ -0,0 +1,391 @@
+from __future__ import annotations
+from typing import Union, List, Dict, Tuple, Iterator, TYPE_CHECKING
+from itertools import islice, takewhile
+from bisect import bisect_left, insort
+from heapq import merge
+import numpy as np
+
+if TYPE_CHECKING:
+    from trading_objects import Order
+
+
+def level_arrays(
+    levels: Iterator[PriceLevel], n: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    prices = np.empty(n, dtype=np.float64)
+    sizes = np.empty(n, dtype=np.int64)
+    counts = np.empty(n, dtype=np.int64)
+    for i, level in enumerate(islice(levels, n)):
+        prices[i] = level.price
+        sizes[i] = level.size
+        counts[i] = level.count
+    return prices, sizes, counts
+
+
+class PriceLevel:
+    # Orders sit in slots in arrival order. Removing an order leaves a None
+    # tombstone so the slots of the other orders stay valid, and the slots are
+    # compacted once the dead fraction passes COMPACTION_THRESHOLD.
+
+    COMPACTION_THRESHOLD = 0.5
+
+    def __init__(
+        self, price: float, index: Dict[int, Tuple[PriceLevel, int]]
+    ) -> None:
+        self.price = price
+        self.slots = []
+        self.first = 0
+        self.size = 0
+        self.count = 0
+        self.__index = index
+
+    def append(self, order: Order) -> None:
+        self.__index[order.id] = (self, len(self.slots))
+        self.slots.append(order)
+        self.size += order.size
+        self.count += 1
+
+    def head(self) -> Order:
+        while self.slots[self.first] is None:
+            self.first += 1
+        return self.slots[self.first]
+
+    def pop_head(self) -> Order:
+        self.head()
+        return self.remove(self.first)
+
+    def remove(self, slot: int) -> Order:
+        order = self.slots[slot]
+        self.slots[slot] = None
+        del self.__index[order.id]
+        self.size -= order.size
+        self.count -= 1
+        self.__maybe_compact()
+        return order
+
+    def reduce(self, amount: int) -> None:
+        self.size -= amount
+
+    def live_orders(self) -> List[Order]:
+        return [order for order in self.slots[self.first :] if order is not None]
+
+    def __maybe_compact(self) -> None:
+        if self.count == 0:
+            self.slots = []
+            self.first = 0
+        elif len(self.slots) - self.count > self.COMPACTION_THRESHOLD * len(
+            self.slots
+        ):
+            self.slots = self.live_orders()
+            self.first = 0
+            for slot, order in enumerate(self.slots):
+                self.__index[order.id] = (self, slot)
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class BookSide:
+    # Levels are indexed by key = dir * price so that the best level of either
+    # side is always the last key in ascending order.
+
+    def __init__(self, dir: int, index: Dict[int, Tuple[PriceLevel, int]]) -> None:
+        self.dir = dir
+        self.levels: Dict[float, PriceLevel] = {}
+        self.__keys = []
+        self.__index = index
+        self.num_orders = 0
+
+    def add(self, order: Order) -> None:
+        level = self.levels.get(order.price, None)
+        if level is None:
+            level = PriceLevel(order.price, self.__index)
+            self.levels[order.price] = level
+            insort(self.__keys, self.dir * order.price)
+        level.append(order)
+        self.num_orders += 1
+
+    def best_level(self) -> Union[PriceLevel, None]:
+        if len(self.__keys) == 0:
+            return None
+        return self.levels[self.dir * self.__keys[-1]]
+
+    def level_at(self, price: float) -> Union[PriceLevel, None]:
+        return self.levels.get(price, None)
+
+    def best_price(self) -> Union[float, None]:
+        if len(self.__keys) == 0:
+            return None
+        return self.dir * self.__keys[-1]
+
+    def pop_head(self, level: PriceLevel) -> Order:
+        order = level.pop_head()
+        self.num_orders -= 1
+        if len(level) == 0:
+            self.remove_level(level)
+        return order
+
+    def remove(self, level: PriceLevel, slot: int) -> Order:
+        order = level.remove(slot)
+        self.num_orders -= 1
+        if len(level) == 0:
+            self.remove_level(level)
+        return order
+
+    def remove_level(self, level: PriceLevel) -> None:
+        key = self.dir * level.price
+        if len(self.__keys) > 0 and self.__keys[-1] == key:
+            self.__keys.pop()
+        else:
+            del self.__keys[bisect_left(self.__keys, key)]
+        del self.levels[level.price]
+
+    def iter_levels(self) -> Iterator[PriceLevel]:
+        # Best level first
+        for key in reversed(self.__keys):
+            yield self.levels[self.dir * key]
+
+    def depth(self, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Price, total size and order count of the best k levels, best first
+        return level_arrays(self.iter_levels(), min(k, len(self.__keys)))
+
+    def depth_through(
+        self, price: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Like depth, for every level priced at or better than price
+        levels = list(
+            takewhile(
+                lambda level: self.dir * (level.price - price) >= 0,
+                self.iter_levels(),
+            )
+        )
+        return level_arrays(levels, len(levels))
+
+    def orders(self) -> List[Order]:
+        # Worst priority first so that the best order is at index -1
+        orders = []
+        for key in self.__keys:
+            orders.extend(reversed(self.levels[self.dir * key].live_orders()))
+        return orders
+
+    def __len__(self) -> int:
+        return self.num_orders
+
+
+class TickLevel(PriceLevel):
+    # A preallocated level whose aggregate size and order count live in the
+    # arrays of the DenseBookSide that owns it.
+
+    def __init__(
+        self,
+        price: float,
+        index: Dict[int, Tuple[PriceLevel, int]],
+        tick: int,
+        sizes: np.ndarray,
+        counts: np.ndarray,
+    ) -> None:
+        self.tick = tick
+        self.__sizes = sizes
+        self.__counts = counts
+        super().__init__(price, index)
+
+    @property
+    def size(self) -> int:
+        return self.__sizes[self.tick]
+
+    @size.setter
+    def size(self, val: int) -> None:
+        self.__sizes[self.tick] = val
+
+    @property
+    def count(self) -> int:
+        return self.__counts[self.tick]
+
+    @count.setter
+    def count(self, val: int) -> None:
+        self.__counts[self.tick] = val
+
+
+class DenseBookSide:
+    # Book side for products with a known price range. Every tick in the range
+    # has a preallocated TickLevel, so finding a level is an array index and the
+    # best level is a pointer that only moves when the touch changes. Prices
+    # outside the range (or off the tick grid) rest in a small sparse BookSide.
+
+    # Number of ticks scanned at once when walking the levels from the best
+    SCAN_BLOCK = 64
+
+    def __init__(
+        self,
+        dir: int,
+        min_price: float,
+        max_price: float,
+        tick_size: float,
+        index: Dict[int, Tuple[PriceLevel, int]],
+    ) -> None:
+        self.dir = dir
+        self.min_price = min_price
+        self.tick_size = tick_size
+        self.num_ticks = int(round((max_price - min_price) / tick_size)) + 1
+
+        self.prices = np.round(
+            min_price + np.arange(self.num_ticks) * tick_size, 2
+        )
+        self.sizes = np.zeros(self.num_ticks, dtype=np.int64)
+        self.counts = np.zeros(self.num_ticks, dtype=np.int64)
+        self.slots = [
+            TickLevel(
+                float(self.prices[i]),
+                index,
+                i,
+                self.sizes,
+                self.counts,
+            )
+            for i in range(self.num_ticks)
+        ]
+        self.overflow = BookSide(dir, index)
+        self.num_orders = 0
+        self.__best = None
+
+    def tick_of(self, price: float) -> Union[int, None]:
+        tick = int(round((price - self.min_price) / self.tick_size))
+        if 0 <= tick < self.num_ticks and self.slots[tick].price == price:
+            return tick
+        return None
+
+    def add(self, order: Order) -> None:
+        tick = self.tick_of(order.price)
+        if tick is None:
+            self.overflow.add(order)
+            return
+        self.slots[tick].append(order)
+        self.num_orders += 1
+        if self.__best is None or self.dir * (tick - self.__best) > 0:
+            self.__best = tick
+
+    def __settle_best(self) -> None:
+        # Walk the best pointer away from the touch until it hits a live level
+        tick = self.__best
+        while tick is not None and len(self.slots[tick]) == 0:
+            tick -= self.dir
+            if tick < 0 or tick >= self.num_ticks:
+                tick = None
+        self.__best = tick
+
+    def best_level(self) -> Union[PriceLevel, None]:
+        dense_best = None if self.__best is None else self.slots[self.__best]
+        overflow_best = self.overflow.best_level()
+        if dense_best is None:
+            return overflow_best
+        if overflow_best is None:
+            return dense_best
+        if self.dir * overflow_best.price > self.dir * dense_best.price:
+            return overflow_best
+        return dense_best
+
+    def level_at(self, price: float) -> Union[PriceLevel, None]:
+        tick = self.tick_of(price)
+        if tick is None:
+            return self.overflow.level_at(price)
+        if len(self.slots[tick]) == 0:
+            return None
+        return self.slots[tick]
+
+    def best_price(self) -> Union[float, None]:
+        level = self.best_level()
+        return None if level is None else level.price
+
+    def pop_head(self, level: PriceLevel) -> Order:
+        if not isinstance(level, TickLevel):
+            return self.overflow.pop_head(level)
+        order = level.pop_head()
+        self.num_orders -= 1
+        if len(level) == 0:
+            self.remove_level(level)
+        return order
+
+    def remove(self, level: PriceLevel, slot: int) -> Order:
+        if not isinstance(level, TickLevel):
+            return self.overflow.remove(level, slot)
+        order = level.remove(slot)
+        self.num_orders -= 1
+        if len(level) == 0:
+            self.remove_level(level)
+        return order
+
+    def remove_level(self, level: PriceLevel) -> None:
+        if not isinstance(level, TickLevel):
+            self.overflow.remove_level(level)
+        elif level.tick == self.__best:
+            self.__settle_best()
+
+    def __ticks(self) -> Iterator[int]:
+        # Non-empty ticks from the best outward, scanned a block at a time and
+        # only until every order has been seen, so readers that stop near the
+        # touch never look at the rest of the range
+        tick = self.__best
+        remaining = self.num_orders
+        while tick is not None and remaining > 0:
+            if self.dir == 1:
+                start = max(tick - DenseBookSide.SCAN_BLOCK + 1, 0)
+                ticks = np.flatnonzero(self.counts[start : tick + 1])[::-1] + start
+                tick = start - 1 if start > 0 else None
+            else:
+                end = min(tick + DenseBookSide.SCAN_BLOCK, self.num_ticks)
+                ticks = np.flatnonzero(self.counts[tick:end]) + tick
+                tick = end if end < self.num_ticks else None
+            for live_tick in ticks.tolist():
+                yield live_tick
+                remaining -= self.counts[live_tick]
+                if remaining <= 0:
+                    return
+
+    def iter_levels(self) -> Iterator[PriceLevel]:
+        # Best level first
+        levels = (self.slots[tick] for tick in self.__ticks())
+        if len(self.overflow) == 0:
+            return levels
+        return merge(
+            levels,
+            self.overflow.iter_levels(),
+            key=lambda level: -self.dir * level.price,
+        )
+
+    def depth(self, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Price, total size and order count of the best k levels, best first
+        if len(self.overflow) > 0:
+            levels = list(islice(self.iter_levels(), k))
+            return level_arrays(levels, len(levels))
+        ticks = np.fromiter(islice(self.__ticks(), k), dtype=np.int64)
+        return self.prices[ticks], self.sizes[ticks], self.counts[ticks]
+
+    def depth_through(
+        self, price: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Like depth, for every level priced at or better than price
+        if len(self.overflow) > 0:
+            levels = list(
+                takewhile(
+                    lambda level: self.dir * (level.price - price) >= 0,
+                    self.iter_levels(),
+                )
+            )
+            return level_arrays(levels, len(levels))
+        ticks = np.fromiter(
+            takewhile(
+                lambda tick: self.dir * (self.prices[tick] - price) >= 0,
+                self.__ticks(),
+            ),
+            dtype=np.int64,
+        )
+        return self.prices[ticks], self.sizes[ticks], self.counts[ticks]
+
+    def orders(self) -> List[Order]:
+        # Worst priority first so that the best order is at index -1
+        orders = []
+        for level in reversed(list(self.iter_levels())):
+            orders.extend(reversed(level.live_orders()))
+        return orders
+
+    def __len__(self) -> int:
+        return self.num_orders + len(self.overflow)
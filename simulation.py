@@ -89,11 +89,9 @@ class SimulationObject:
     @staticmethod
     def cache_wrapper(f):
         def g(self):
-            v = self.__cache.get(f.__name__, None)
-            if v is None:
-                return f(self)
-            else:
-                return v
+            if f.__name__ not in self.__cache:
+                self.__cache[f.__name__] = f(self)
+            return self.__cache[f.__name__]
 
         return g
 
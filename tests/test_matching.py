@@ -0,0 +1,69 @@
+from typing import Tuple
+import numpy as np
+
+from market_simulation import MarketSimulation
+from simulation import Time
+from trading_objects import Agent, Exchange, Product
+
+
+class BoundedProduct(Product):
+    def price_bounds(self) -> Tuple[float, float]:
+        return 0, 20
+
+
+class RandomAgent(Agent):
+    # Places a few crossing limit orders around 10 every tick and records every
+    # execute_trade callback it gets
+    def __init__(self, seed: int) -> None:
+        super().__init__()
+        self.rng = np.random.default_rng(seed)
+        self.executions = []
+
+    def update(self) -> None:
+        super().update()
+        for _ in range(3):
+            self.limit_order(
+                1 if self.rng.random() < 0.5 else -1,
+                10 + self.rng.integers(-5, 6) * 0.01,
+                int(self.rng.integers(1, 10)),
+                frames_to_expire=int(self.rng.integers(1, 10)),
+            )
+
+    def executed_trade(self, symbol: str, dir: int, price: float, size: int) -> None:
+        self.executions.append((Time.now, symbol, dir, price, size))
+
+
+def run(jit_matching: bool) -> Tuple[list, list]:
+    start = Time.now
+    exchange = Exchange(jit_matching=jit_matching)
+    agents = [RandomAgent(seed) for seed in range(5)]
+    MarketSimulation(
+        exchanges=exchange,
+        agents=agents,
+        products=[BoundedProduct("A")],
+        dt=0,
+        iter=start + 200,
+        payout_on_finish=False,
+    ).run()
+    names = {agent.global_id: i for i, agent in enumerate(agents)}
+    trades = [
+        (
+            trade.time - start,
+            trade.price,
+            trade.size,
+            names[trade.buyer_id],
+            names[trade.seller_id],
+        )
+        for trade in exchange._Exchange__products["A"].trades
+    ]
+    executions = [
+        [(time - start, *execution) for time, *execution in agent.executions]
+        for agent in agents
+    ]
+    return trades, executions
+
+
+def test_dense_kernel_matches_reference_loop():
+    trades, executions = run(jit_matching=False)
+    assert len(trades) > 0
+    assert run(jit_matching=True) == (trades, executions)
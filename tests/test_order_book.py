@@ -0,0 +1,50 @@
+from market_simulation import MarketSimulation
+from simulation import Time
+from trading_objects import Agent, Exchange, Product
+
+
+class ScriptedAgent(Agent):
+    # Runs actions[t](self) on the t-th tick of the run
+    def __init__(self, actions: dict) -> None:
+        super().__init__()
+        self.actions = actions
+        self.start = None
+
+    def update(self) -> None:
+        super().update()
+        if self.start is None:
+            self.start = Time.now
+        action = self.actions.get(Time.now - self.start, None)
+        if action is not None:
+            action(self)
+
+
+def run(agents: list) -> Exchange:
+    exchange = Exchange()
+    MarketSimulation(
+        exchanges=exchange,
+        agents=agents,
+        products=[Product("A")],
+        dt=0,
+        iter=Time.now + 5,
+        payout_on_finish=False,
+    ).run()
+    return exchange
+
+
+def test_later_orders_in_a_batch_queue_first():
+    first = ScriptedAgent({0: lambda agent: agent.bid(10, 1)})
+    second = ScriptedAgent({0: lambda agent: agent.bid(10, 1)})
+    seller = ScriptedAgent({2: lambda agent: agent.ask(10, 1)})
+    exchange = run([first, second, seller])
+    trades = exchange._Exchange__products["A"].trades
+    assert [trade.buyer_id for trade in trades] == [second.global_id]
+
+
+def test_resting_orders_keep_priority_over_a_new_batch():
+    first = ScriptedAgent({0: lambda agent: agent.bid(10, 1)})
+    second = ScriptedAgent({1: lambda agent: agent.bid(10, 1)})
+    seller = ScriptedAgent({3: lambda agent: agent.ask(10, 1)})
+    exchange = run([first, second, seller])
+    trades = exchange._Exchange__products["A"].trades
+    assert [trade.buyer_id for trade in trades] == [first.global_id]
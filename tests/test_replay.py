@@ -0,0 +1,69 @@
+import numpy as np
+
+from market_simulation import MarketSimulation
+from simulation import Time
+from trading_objects import Agent, Exchange, Order, Product
+
+
+class RandomAgent(Agent):
+    def __init__(self, seed: int) -> None:
+        super().__init__()
+        self.rng = np.random.default_rng(seed)
+
+    def update(self) -> None:
+        super().update()
+        dir = Order.BUY_DIR if self.rng.random() < 0.5 else Order.SELL_DIR
+        price = 100 + self.rng.integers(-10, 11) * 0.05
+        self.limit_order(
+            dir,
+            price,
+            int(self.rng.integers(1, 10)),
+            frames_to_expire=int(self.rng.integers(1, 20)),
+        )
+        if len(self.open_orders) > 0 and self.rng.random() < 0.2:
+            order_id = list(self.open_orders)[self.rng.integers(len(self.open_orders))]
+            if self.rng.random() < 0.5:
+                self.cancel(order_id)
+            else:
+                self.amend(order_id, size=int(self.rng.integers(1, 10)))
+
+
+def trades(exchange: Exchange, start: int, names: dict) -> list:
+    return [
+        (
+            trade.price,
+            trade.size,
+            names.get(trade.buyer_id, trade.buyer_id),
+            names.get(trade.seller_id, trade.seller_id),
+            trade.time - start,
+        )
+        for trade in exchange._Exchange__products["A"].trades
+    ]
+
+
+def test_record_and_replay_in_one_process(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    start = Time.now
+    exchange = Exchange(tick_size=0.05, journal_path=path)
+    agents = [RandomAgent(seed) for seed in range(4)]
+    MarketSimulation(
+        exchanges=exchange,
+        agents=agents,
+        products=[Product("A")],
+        dt=0,
+        iter=start + 200,
+        payout_on_finish=False,
+    ).run()
+    recorded = trades(exchange, start, {})
+    assert len(recorded) > 0
+
+    replay_start = Time.now
+    simulation = MarketSimulation.replay(path, payout_on_finish=False)
+    simulation.run()
+    replay_exchange = simulation.exchanges[0]
+    assert replay_exchange.tick_size == 0.05
+    names = {
+        agent.global_id: agent.name
+        for agent in simulation.agents[0].replayed_agents
+    }
+    assert trades(replay_exchange, replay_start, names) == recorded
@@ -0,0 +1,55 @@
+from market_simulation import MarketSimulation
+from simulation import Time
+from trading_objects import Agent, Event, Exchange, Order, Product
+
+
+class Trader(Agent):
+    # Crosses the spread every tick and again whenever it is told about the
+    # tick's trades, recording the ticks its fills are settled on
+    def __init__(self, dir: int) -> None:
+        super().__init__()
+        self.dir = dir
+        self.settled_at = []
+
+    def register_exchange(self, exchange: Exchange) -> None:
+        super().register_exchange(exchange)
+        exchange.subscribe(
+            self, self.on_trades, event_types=[Event.TRADE], batched=True
+        )
+
+    def trade(self) -> None:
+        self.limit_order(self.dir, 10, 2)
+        self.limit_order(-self.dir, 10, 1)
+
+    def update(self) -> None:
+        super().update()
+        self.trade()
+
+    def on_trades(self, events: list) -> None:
+        self.trade()
+
+    def executed_trades(self, executions: list) -> None:
+        self.settled_at.append(Time.now)
+
+
+def run(continuous_matching: bool) -> list:
+    exchange = Exchange(
+        continuous_matching=continuous_matching, batch_settlement=True
+    )
+    agents = [Trader(Order.BUY_DIR), Trader(Order.SELL_DIR)]
+    MarketSimulation(
+        exchanges=exchange,
+        agents=agents,
+        products=[Product("A")],
+        dt=0,
+        iter=Time.now + 20,
+        payout_on_finish=False,
+    ).run()
+    return agents
+
+
+def test_one_settlement_per_tick():
+    for continuous_matching in (False, True):
+        for agent in run(continuous_matching):
+            assert len(agent.settled_at) > 0
+            assert len(agent.settled_at) == len(set(agent.settled_at))
@@ -0,0 +1,66 @@
+from typing import Any, List
+
+
+class TimingWheel:
+    # Hierarchical timing wheel keyed by integer tick. Level L has
+    # slots_per_level buckets that each span slots_per_level ** L ticks, so an
+    # item is stored in the lowest level that can reach its due tick and is
+    # cascaded down as that bucket comes around. Scheduling and firing are O(1)
+    # per item no matter how far away the due tick is.
+
+    def __init__(
+        self, start: int = 0, slots_per_level: int = 64, num_levels: int = 3
+    ) -> None:
+        self.__slots_per_level = slots_per_level
+        self.__num_levels = num_levels
+        self.__spans = [slots_per_level**level for level in range(num_levels + 1)]
+        self.__levels = [
+            [[] for _ in range(slots_per_level)] for _ in range(num_levels)
+        ]
+        self.__overflow = []
+        self.__now = start
+        self.__size = 0
+
+    def schedule(self, item: Any, due: int) -> None:
+        self.__size += 1
+        self.__insert(item, max(due, self.__now))
+
+    def __insert(self, item: Any, due: int) -> None:
+        delta = due - self.__now
+        for level in range(self.__num_levels):
+            if delta < self.__spans[level + 1]:
+                slot = (due // self.__spans[level]) % self.__slots_per_level
+                self.__levels[level][slot].append((due, item))
+                return
+        self.__overflow.append((due, item))
+
+    def __cascade(self, level: int) -> None:
+        if level == self.__num_levels:
+            bucket, self.__overflow = self.__overflow, []
+        else:
+            slot = (self.__now // self.__spans[level]) % self.__slots_per_level
+            bucket = self.__levels[level][slot]
+            self.__levels[level][slot] = []
+        for due, item in bucket:
+            self.__insert(item, due)
+
+    def pop_due(self, tick: int) -> List[Any]:
+        due_items = []
+        while self.__now <= tick:
+            top = 0
+            while top < self.__num_levels and self.__now % self.__spans[top + 1] == 0:
+                top += 1
+            for level in range(top, 0, -1):
+                self.__cascade(level)
+
+            slot = self.__now % self.__slots_per_level
+            bucket = self.__levels[0][slot]
+            if len(bucket) > 0:
+                self.__levels[0][slot] = []
+                due_items.extend(item for _, item in bucket)
+            self.__now += 1
+        self.__size -= len(due_items)
+        return due_items
+
+    def __len__(self) -> int:
+        return self.__size
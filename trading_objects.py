@@ -1,9 +1,21 @@
 from __future__ import annotations
 from typing import Union, List, Dict, Tuple, Callable
-from collections import namedtuple
+from collections import namedtuple, deque
+from heapq import heappush, heappop
+import threading
+import numpy as np
 
-from util import prefix_lines, effective_inf
+from util import prefix_lines
 from simulation import Time, SimulationObject
+from price_levels import BookSide, DenseBookSide
+from timing_wheel import TimingWheel
+from ledger import Ledger
+from auction import clearing_price
+from matching_kernels import match_dense
+from book_feed import BookDelta, BookSnapshot
+from book_views import ExchangeView
+from event_log import EventLog
+from journal import Journal
 
 
 class Order(SimulationObject):
@@ -13,6 +25,15 @@ class Order(SimulationObject):
     BUY_DIR = 1
     SELL_DIR = -1
 
+    # Time in force. GTC orders rest in the book until filled, cancelled or
+    # expired. IOC and FOK orders sweep the opposite side once and never rest,
+    # FOK only if it can be filled completely. MARKET orders are IOC orders
+    # without a price limit.
+    GTC = 0
+    IOC = 1
+    FOK = 2
+    MARKET = 3
+
     margin = DISPLAY_COLUMN_MARGIN * " "
 
     PublicInfo = namedtuple("OrderInfo", ["id", "price", "size"])
@@ -22,10 +43,11 @@ class Order(SimulationObject):
         sender: Agent,
         symbol: str,
         dir: int,
-        price: float,
+        price: Union[float, None],
         size: int,
         exchange: Exchange,
         frames_to_expire: Union[int, None] = None,
+        time_in_force: int = GTC,
     ) -> None:
         super().__init__()
 
@@ -35,28 +57,42 @@ class Order(SimulationObject):
         self.__price = price
         self.__size = size
         self.__exchange = exchange
+        self.__time_in_force = time_in_force
+        if time_in_force != Order.GTC:
+            frames_to_expire = None
         if frames_to_expire is not None:
-            self.__frames_to_expire = frames_to_expire + 1  # decremented on add
+            # Expired by the exchange at the start of this tick
+            self.__expires_at = Time.now + frames_to_expire + 1
         else:
-            self.__frames_to_expire = None
+            self.__expires_at = None
         self.__expired = frames_to_expire == 0
         self.__cancelled = False
+        # Tick at which the order last took its place in the queue
+        self.__timestamp = Time.now
 
     def place(self) -> int:
         self.__exchange.place_order(self)
         return self.id
 
-    def update(self) -> None:
-        super().update()
-        if self.__frames_to_expire is not None:
-            self.__frames_to_expire -= 1
-            if self.__frames_to_expire <= 0:
-                self.__expired = True
-
     def decrement_size(self, amount: int, book: OrderBook) -> None:
         if isinstance(book, OrderBook):
             self.__size -= amount
 
+    def amend(
+        self,
+        price: Union[float, None],
+        size: int,
+        expires_at: Union[int, None],
+        keep_priority: bool,
+        book: OrderBook,
+    ) -> None:
+        if isinstance(book, OrderBook):
+            self.__price = price
+            self.__size = size
+            self.__expires_at = expires_at
+            if not keep_priority:
+                self.__timestamp = Time.now
+
     def voided(self) -> bool:
         return self.__size == 0 or self.__expired or self.__cancelled
 
@@ -66,9 +102,20 @@ class Order(SimulationObject):
     def is_ask(self) -> bool:
         return self.__dir == Order.SELL_DIR
 
+    def rests(self) -> bool:
+        return self.__time_in_force == Order.GTC
+
+    def accepts_price(self, price: float) -> bool:
+        if self.__price is None:
+            return True
+        return self.__dir * (self.__price - price) >= 0
+
     def cancel(self) -> None:
         self.__cancelled = True
 
+    def expire(self) -> None:
+        self.__expired = True
+
     def public_info(self) -> Order.PublicInfo:
         return Order.PublicInfo(self.id, self.price, self.size)
 
@@ -96,13 +143,27 @@ class Order(SimulationObject):
     def exchange(self):
         return self.__exchange
 
+    @property
+    def time_in_force(self):
+        return self.__time_in_force
+
+    @property
+    def expires_at(self):
+        return self.__expires_at
+
+    @property
+    def timestamp(self):
+        return self.__timestamp
+
     @property
     def frames_to_expire(self):
-        return self.__frames_to_expire
+        if self.__expires_at is None:
+            return None
+        return self.__expires_at - Time.now - 1
 
     def display_str(self, viewer: Union[Agent, None] = None) -> str:
         frames_to_expire = (
-            "" if self.__frames_to_expire is None else self.__frames_to_expire
+            "" if self.__expires_at is None else self.frames_to_expire
         )
         sender = "You" if self.sender == viewer else "Anon"
 
@@ -127,161 +188,674 @@ class Order(SimulationObject):
 
 
 class OrderBook(SimulationObject):
+    # Number of levels per side averaged into the depth-weighted mid
+    FEATURE_DEPTH = 5
+    # Number of recent deltas kept per book for recovery
+    DELTA_BUFFER_SIZE = 4096
+
     PublicInfo = namedtuple("OrderBookInfo", ["bids", "asks"])
+    TopOfBook = namedtuple(
+        "TopOfBook",
+        [
+            "bid",
+            "bid_size",
+            "bid_count",
+            "ask",
+            "ask_size",
+            "ask_count",
+            "last_price",
+            "last_size",
+        ],
+    )
+    Fill = namedtuple("Fill", ["price", "size"])
+    Features = namedtuple(
+        "BookFeatures", ["spread", "imbalance", "microprice", "depth_mid"]
+    )
+    Depth = namedtuple(
+        "OrderBookDepth",
+        [
+            "bid_prices",
+            "bid_sizes",
+            "bid_counts",
+            "ask_prices",
+            "ask_sizes",
+            "ask_counts",
+        ],
+    )
 
-    def __init__(self, symbol: str, exchange: Exchange) -> None:
+    def __init__(
+        self,
+        symbol: str,
+        exchange: Exchange,
+        price_bounds: Union[Tuple[float, float], None] = None,
+        continuous: bool = False,
+        auction_interval: Union[int, None] = None,
+        closing_auction_window: int = 0,
+        jit_matching: bool = False,
+    ) -> None:
         super().__init__()
 
-        self.bids = []
-        self.asks = []
+        # order id -> (level, slot) for every order resting in this book
+        self.__order_index = {}
+
+        if price_bounds is None:
+            self.bids = BookSide(Order.BUY_DIR, self.__order_index)
+            self.asks = BookSide(Order.SELL_DIR, self.__order_index)
+        else:
+            min_price, max_price = price_bounds
+            self.bids = DenseBookSide(
+                Order.BUY_DIR,
+                min_price,
+                max_price,
+                exchange.tick_size,
+                self.__order_index,
+            )
+            self.asks = DenseBookSide(
+                Order.SELL_DIR,
+                min_price,
+                max_price,
+                exchange.tick_size,
+                self.__order_index,
+            )
         self.symbol = symbol.upper()
         self.exchange = exchange
-
+        self.__journal = None if exchange is None else exchange.journal
+        # Bumped whenever the book settles after a change. public_info is
+        # built from the book at most once per tick and version.
+        self.__version = 0
+        self.__public_info = None
+        self.__public_info_key = None
+
+        self.continuous = continuous
+        # Batch mode only. Books with an auction interval match solely by call
+        # auction on ticks divisible by it, and every tick of the closing
+        # window is a call auction.
+        self.auction_interval = auction_interval
+        self.closing_auction_window = closing_auction_window
+        # Match dense books with the array kernel, compiled when numba is
+        # installed
+        self.jit_matching = jit_matching
         self._orders_to_place = []
 
-    def __place_orders(self, *orders: List[Order]) -> None:
-        # Place Bids
-        bids_to_place = sorted(
-            [order for order in orders if order.is_bid()],
-            key=lambda order: order.price,
-        )
-
-        bids_to_place_idx = 0
-        cur_bid_idx = 0
-        new_bids = []
+        # Requests made from trade and event callbacks while the book is
+        # matching are run once the matching is done
+        self.__matching = False
+        self.__deferred = []
+
+        # Top of book, refreshed whenever the touch of either side can change
+        self.__bid = None
+        self.__bid_size = 0
+        self.__bid_count = 0
+        self.__ask = None
+        self.__ask_size = 0
+        self.__ask_count = 0
+        self.__last_price = None
+        self.__last_size = None
+
+        # Touch features are kept with the top of book. The depth-weighted
+        # mid reads several levels, so it is only recomputed when read after
+        # the book has changed.
+        self.__spread = None
+        self.__imbalance = None
+        self.__microprice = None
+        self.__depth_mid = None
+        self.__depth_mid_stale = False
+
+        # Level delta feed, off until the exchange has a delta subscriber.
+        # Mutations mark the levels they touch and the marked levels are
+        # diffed against the last published state whenever the book settles.
+        self.__delta_feed = False
+        self.__seq = 0
+        self.__delta_buffer = deque(maxlen=OrderBook.DELTA_BUFFER_SIZE)
+        self.__changed_levels = {}
+        self.__published_levels = {}
+        self.__trades_to_publish = []
+
+    def __refresh_top(self) -> None:
+        previous_top = (self.__bid, self.__bid_size, self.__ask, self.__ask_size)
+        level = self.bids.best_level()
+        if level is None:
+            self.__bid, self.__bid_size, self.__bid_count = None, 0, 0
+        else:
+            self.__bid = level.price
+            self.__bid_size = int(level.size)
+            self.__bid_count = int(level.count)
+        level = self.asks.best_level()
+        if level is None:
+            self.__ask, self.__ask_size, self.__ask_count = None, 0, 0
+        else:
+            self.__ask = level.price
+            self.__ask_size = int(level.size)
+            self.__ask_count = int(level.count)
+        if previous_top != (self.__bid, self.__bid_size, self.__ask, self.__ask_size):
+            self.exchange.top_changed(
+                self.symbol, self.__bid, self.__bid_size, self.__ask, self.__ask_size
+            )
 
-        while cur_bid_idx < len(self.bids) and bids_to_place_idx < len(bids_to_place):
-            if bids_to_place[bids_to_place_idx].price <= self.bids[cur_bid_idx].price:
-                new_bids.append(bids_to_place[bids_to_place_idx])
-                bids_to_place_idx += 1
+        self.__depth_mid_stale = True
+        if self.__bid is None or self.__ask is None:
+            self.__spread = None
+            self.__imbalance = None
+            self.__microprice = None
+        else:
+            touch_size = self.__bid_size + self.__ask_size
+            self.__spread = self.__ask - self.__bid
+            self.__imbalance = (self.__bid_size - self.__ask_size) / touch_size
+            self.__microprice = (
+                self.__bid * self.__ask_size + self.__ask * self.__bid_size
+            ) / touch_size
+
+    def __book_changed(self) -> None:
+        self.__version += 1
+        self.__refresh_top()
+        if self.__delta_feed:
+            self.__publish_deltas()
+
+    def __mark_level(self, dir: int, price: Union[float, None]) -> None:
+        if self.__delta_feed and price is not None:
+            self.__changed_levels[(dir, price)] = None
+
+    def __publish_deltas(self) -> None:
+        deltas = []
+        for price, size in self.__trades_to_publish:
+            self.__seq += 1
+            deltas.append(
+                BookDelta(
+                    self.symbol, self.__seq, BookDelta.TRADE, None, price, size, None
+                )
+            )
+        for dir, price in self.__changed_levels:
+            side = self.bids if dir == Order.BUY_DIR else self.asks
+            level = side.level_at(price)
+            published = self.__published_levels.get((dir, price), None)
+            if level is None:
+                if published is None:
+                    continue
+                action, size, count = BookDelta.DELETE, 0, 0
+                del self.__published_levels[(dir, price)]
             else:
-                new_bids.append(self.bids[cur_bid_idx])
-                cur_bid_idx += 1
-
-        while bids_to_place_idx < len(bids_to_place):
-            new_bids.append(bids_to_place[bids_to_place_idx])
-            bids_to_place_idx += 1
-        while cur_bid_idx < len(self.bids):
-            new_bids.append(self.bids[cur_bid_idx])
-            cur_bid_idx += 1
-
-        self.bids = new_bids
+                size, count = int(level.size), int(level.count)
+                if published == (size, count):
+                    continue
+                action = BookDelta.ADD if published is None else BookDelta.UPDATE
+                self.__published_levels[(dir, price)] = size, count
+            self.__seq += 1
+            deltas.append(
+                BookDelta(self.symbol, self.__seq, action, dir, price, size, count)
+            )
+        self.__trades_to_publish = []
+        self.__changed_levels = {}
+        if len(deltas) > 0:
+            self.__delta_buffer.extend(deltas)
+            self.exchange.send_book_deltas(deltas)
+
+    def enable_delta_feed(self) -> None:
+        if self.__delta_feed:
+            return
+        self.__delta_feed = True
+        for side in (self.bids, self.asks):
+            for level in side.iter_levels():
+                self.__published_levels[(side.dir, level.price)] = (
+                    int(level.size),
+                    int(level.count),
+                )
 
-        # Place Asks
-        asks_to_place = sorted(
-            [order for order in orders if order.is_ask()],
-            key=lambda order: order.price,
-            reverse=True,
+    def snapshot(self) -> BookSnapshot:
+        depth = self.depth(-1)
+        return BookSnapshot(
+            self.symbol,
+            self.__seq,
+            list(
+                zip(
+                    depth.bid_prices.tolist(),
+                    depth.bid_sizes.tolist(),
+                    depth.bid_counts.tolist(),
+                )
+            ),
+            list(
+                zip(
+                    depth.ask_prices.tolist(),
+                    depth.ask_sizes.tolist(),
+                    depth.ask_counts.tolist(),
+                )
+            ),
         )
 
-        asks_to_place_idx = 0
-        cur_ask_idx = 0
-        new_asks = []
+    def recover(
+        self, seq: Union[int, None]
+    ) -> Tuple[Union[BookSnapshot, None], List[BookDelta]]:
+        # Replay the buffered deltas after seq, or start over from a snapshot
+        # when they are no longer all buffered
+        if (
+            seq is not None
+            and seq <= self.__seq
+            and (seq == self.__seq or self.__delta_buffer[0].seq <= seq + 1)
+        ):
+            return None, [delta for delta in self.__delta_buffer if delta.seq > seq]
+        return self.snapshot(), []
+
+    def __refresh_depth_mid(self) -> None:
+        self.__depth_mid_stale = False
+        if self.__bid is None or self.__ask is None:
+            self.__depth_mid = None
+            return
+        bid_prices, bid_sizes, _ = self.bids.depth(OrderBook.FEATURE_DEPTH)
+        ask_prices, ask_sizes, _ = self.asks.depth(OrderBook.FEATURE_DEPTH)
+        bid_volume = np.sum(bid_sizes)
+        ask_volume = np.sum(ask_sizes)
+        self.__depth_mid = float(
+            (np.mean(bid_prices) * ask_volume + np.mean(ask_prices) * bid_volume)
+            / (bid_volume + ask_volume)
+        )
 
-        while cur_ask_idx < len(self.asks) and asks_to_place_idx < len(asks_to_place):
-            if asks_to_place[asks_to_place_idx].price >= self.asks[cur_ask_idx].price:
-                new_asks.append(asks_to_place[asks_to_place_idx])
-                asks_to_place_idx += 1
+    def __place_orders(self, *orders: List[Order]) -> None:
+        for order in orders:
+            if order.voided() or not order.rests():
+                continue
+            if order.is_bid():
+                self.bids.add(order)
             else:
-                new_asks.append(self.asks[cur_ask_idx])
-                cur_ask_idx += 1
-
-        while asks_to_place_idx < len(asks_to_place):
-            new_asks.append(asks_to_place[asks_to_place_idx])
-            asks_to_place_idx += 1
-        while cur_ask_idx < len(self.asks):
-            new_asks.append(self.asks[cur_ask_idx])
-            cur_ask_idx += 1
-
-        self.asks = new_asks
+                self.asks.add(order)
+            self.__mark_level(order.dir, order.price)
+            if self.__journal is not None:
+                self.__journal.rest(Time.now, order)
+        self.__book_changed()
+
+    def __fill(
+        self, bid: Order, ask: Order, price: float, size: Union[int, None] = None
+    ) -> int:
+        if size is None:
+            size = min(bid.size, ask.size)
+        if self.exchange is not None and bid.sender != ask.sender:
+            self.exchange.execute_trade(
+                self.symbol,
+                price,
+                size,
+                bid.sender,
+                ask.sender,
+            )
+            self.__last_price = price
+            self.__last_size = size
+            if self.__delta_feed:
+                self.__trades_to_publish.append((price, size))
+        if self.__journal is not None:
+            self.__journal.fill(Time.now, bid, ask, price, size)
+        self.__mark_level(Order.BUY_DIR, bid.price)
+        self.__mark_level(Order.SELL_DIR, ask.price)
+        ask.decrement_size(size, self)
+        bid.decrement_size(size, self)
+        return size
 
     def __match_orders(self) -> None:
-        while (
-            len(self.bids) > 0
-            and len(self.asks) > 0
-            and self.bids[-1].price >= self.asks[-1].price
+        if (
+            self.jit_matching
+            and isinstance(self.bids, DenseBookSide)
+            and len(self.bids.overflow) == 0
+            and len(self.asks.overflow) == 0
         ):
-            matched_bid = self.bids[-1]
-            matched_ask = self.asks[-1]
-            if matched_bid.created_at <= matched_ask.created_at:
+            self.__match_orders_dense()
+            return
+        while True:
+            bid_level = self.bids.best_level()
+            ask_level = self.asks.best_level()
+            if (
+                bid_level is None
+                or ask_level is None
+                or bid_level.price < ask_level.price
+            ):
+                break
+            matched_bid = bid_level.head()
+            matched_ask = ask_level.head()
+            if matched_bid.timestamp <= matched_ask.timestamp:
                 trade_price = matched_bid.price
             else:
                 trade_price = matched_ask.price
-            trade_size = min(matched_bid.size, matched_ask.size)
-            if self.exchange is not None and matched_bid.sender != matched_ask.sender:
-                self.exchange.execute_trade(
-                    self.symbol,
-                    trade_price,
-                    trade_size,
-                    matched_bid.sender,
-                    matched_ask.sender,
-                )
-            matched_ask.decrement_size(trade_size, self)
-            matched_bid.decrement_size(trade_size, self)
+            trade_size = self.__fill(matched_bid, matched_ask, trade_price)
+            bid_level.reduce(trade_size)
+            ask_level.reduce(trade_size)
+            if matched_bid.voided():
+                self.bids.pop_head(bid_level)
+            if matched_ask.voided():
+                self.asks.pop_head(ask_level)
+        self.__book_changed()
+
+    def __crossed_orders(self, side: DenseBookSide, limit: float) -> List[Order]:
+        orders = []
+        for level in side.iter_levels():
+            if side.dir * (level.price - limit) < 0:
+                break
+            orders.extend(level.live_orders())
+        return orders
+
+    def __match_orders_dense(self) -> None:
+        # Same matching as __match_orders. The kernel pairs the crossed orders
+        # and takes the fills off the level sizes of both sides, so only the
+        # trades themselves and the filled orders go through Python.
+        bid_level = self.bids.best_level()
+        ask_level = self.asks.best_level()
+        if (
+            bid_level is None
+            or ask_level is None
+            or bid_level.price < ask_level.price
+        ):
+            return
+        bids = self.__crossed_orders(self.bids, ask_level.price)
+        asks = self.__crossed_orders(self.asks, bid_level.price)
+        bid_ticks = np.array(
+            [self.bids.tick_of(order.price) for order in bids], dtype=np.int64
+        )
+        ask_ticks = np.array(
+            [self.asks.tick_of(order.price) for order in asks], dtype=np.int64
+        )
+        fills = match_dense(
+            bid_ticks,
+            np.array([order.size for order in bids], dtype=np.int64),
+            np.array([order.timestamp for order in bids], dtype=np.int64),
+            ask_ticks,
+            np.array([order.size for order in asks], dtype=np.int64),
+            np.array([order.timestamp for order in asks], dtype=np.int64),
+            self.bids.sizes,
+            self.asks.sizes,
+        )
+        for i, j, bid_priced, size in zip(*(fill.tolist() for fill in fills)):
+            matched_bid = bids[i]
+            matched_ask = asks[j]
+            trade_price = matched_bid.price if bid_priced else matched_ask.price
+            self.__fill(matched_bid, matched_ask, trade_price, size)
             if matched_bid.voided():
-                self.bids.pop()
+                self.bids.pop_head(self.bids.slots[bid_ticks[i]])
             if matched_ask.voided():
-                self.asks.pop()
+                self.asks.pop_head(self.asks.slots[ask_ticks[j]])
+        self.__book_changed()
 
-    def __clean_orders(self) -> None:
-        self.bids = [order for order in self.bids if not order.voided()]
-        self.asks = [order for order in self.asks if not order.voided()]
+    def __auction_due(self) -> bool:
+        if (
+            self.auction_interval is not None
+            and Time.now % self.auction_interval == 0
+        ):
+            return True
+        return (
+            self.closing_auction_window > 0
+            and self.exchange.time_remaining <= self.closing_auction_window
+        )
+
+    def __run_auction(self) -> None:
+        # Uncross the book at a single price, filling in price-time priority
+        bid_level = self.bids.best_level()
+        ask_level = self.asks.best_level()
+        if (
+            bid_level is None
+            or ask_level is None
+            or bid_level.price < ask_level.price
+        ):
+            return
+        bid_prices, bid_sizes, _ = self.bids.depth_through(ask_level.price)
+        ask_prices, ask_sizes, _ = self.asks.depth_through(bid_level.price)
+        price, volume = clearing_price(bid_prices, bid_sizes, ask_prices, ask_sizes)
+        while volume > 0:
+            bid_level = self.bids.best_level()
+            ask_level = self.asks.best_level()
+            matched_bid = bid_level.head()
+            matched_ask = ask_level.head()
+            trade_size = self.__fill(
+                matched_bid,
+                matched_ask,
+                price,
+                min(matched_bid.size, matched_ask.size, volume),
+            )
+            volume -= trade_size
+            bid_level.reduce(trade_size)
+            ask_level.reduce(trade_size)
+            if matched_bid.voided():
+                self.bids.pop_head(bid_level)
+            if matched_ask.voided():
+                self.asks.pop_head(ask_level)
+        self.__book_changed()
+
+    def __available_size(self, order: Order) -> int:
+        side = self.asks if order.is_bid() else self.bids
+        available = 0
+        for level in side.iter_levels():
+            if available >= order.size or not order.accepts_price(level.price):
+                break
+            available += level.size
+        return available
+
+    def __sweep(self, order: Order) -> List[OrderBook.Fill]:
+        # Take liquidity for an incoming order at the resting prices
+        fills = []
+        if (
+            order.time_in_force == Order.FOK
+            and self.__available_size(order) < order.size
+        ):
+            return fills
+        side = self.asks if order.is_bid() else self.bids
+        while not order.voided():
+            level = side.best_level()
+            if level is None or not order.accepts_price(level.price):
+                break
+            resting = level.head()
+            if order.is_bid():
+                trade_size = self.__fill(order, resting, resting.price)
+            else:
+                trade_size = self.__fill(resting, order, resting.price)
+            fills.append(OrderBook.Fill(resting.price, trade_size))
+            level.reduce(trade_size)
+            if resting.voided():
+                side.pop_head(level)
+        self.__book_changed()
+        return fills
+
+    def __execute(self, order: Order) -> List[OrderBook.Fill]:
+        # Continuous mode: match the order on arrival and rest what is left
+        if order.voided():
+            return []
+        fills = self.__sweep(order)
+        if order.rests():
+            self.__place_orders(order)
+        elif not order.voided():
+            order.cancel()
+        if not order.voided():
+            self.exchange.send_order_update(order)
+        return fills
+
+    def __run_deferred(self) -> None:
+        while len(self.__deferred) > 0 and not self.__matching:
+            method, args = self.__deferred.pop(0)
+            method(*args)
+
+    def place_order(self, order: Order) -> List[OrderBook.Fill]:
+        if not self.continuous:
+            self._orders_to_place.append(order)
+            self.exchange.mark_dirty(self.symbol)
+            return []
+        if self.__matching:
+            self.__deferred.append((self.place_order, (order,)))
+            return []
+        self.__matching = True
+        fills = self.__execute(order)
+        self.__matching = False
+        self.__run_deferred()
+        return fills
+
+    def cancel_order(self, order: Order) -> None:
+        if self.__matching:
+            self.__deferred.append((self.cancel_order, (order,)))
+            return
+        order.cancel()
+        self.__remove_order(order)
+
+    def amend_order(
+        self,
+        order: Order,
+        price: Union[float, None],
+        size: Union[int, None],
+        expires_at: Union[int, None],
+    ) -> bool:
+        if order.voided():
+            return False
+        if self.__matching:
+            self.__deferred.append(
+                (self.amend_order, (order, price, size, expires_at))
+            )
+            return True
+        price = order.price if price is None else price
+        size = order.size if size is None else size
+        if size <= 0:
+            self.cancel_order(order)
+            return True
 
-    def __remove_resting_market_orders(self):
-        for order in self.bids:
-            if order.price >= effective_inf:
-                order.cancel()
-        for order in self.asks:
-            if order.price <= 0:
-                order.cancel()
-        self.__clean_orders()
+        location = self.__order_index.get(order.id, None)
+        if location is None:
+            # Still waiting to be placed, so there is no queue position to keep
+            order.amend(price, size, expires_at, True, self)
+            return True
 
-    def place_order(self, order: Order) -> None:
-        self._orders_to_place.append(order)
+        level, slot = location
+        if price == order.price and size <= order.size:
+            level.reduce(order.size - size)
+            order.amend(price, size, expires_at, True, self)
+            self.__mark_level(order.dir, price)
+            if self.__journal is not None:
+                self.__journal.reduce(Time.now, order)
+            self.__book_changed()
+            return True
 
-    def cancel_order(self, order_id: int) -> None:
-        Order.get_instance(order_id).cancel()
+        # A new price or a larger size goes to the back of the queue and is
+        # placed with the next batch like a new order
+        side = self.bids if order.is_bid() else self.asks
+        side.remove(level, slot)
+        self.__mark_level(order.dir, order.price)
+        if self.__journal is not None:
+            self.__journal.remove(Time.now, order)
+        self.__book_changed()
+        order.amend(price, size, expires_at, False, self)
+        self.place_order(order)
+        return True
+
+    def expire_order(self, order: Order) -> None:
+        order.expire()
+        self.__remove_order(order)
+
+    def __remove_order(self, order: Order) -> None:
+        location = self.__order_index.get(order.id, None)
+        if location is not None:
+            level, slot = location
+            side = self.bids if order.is_bid() else self.asks
+            side.remove(level, slot)
+            self.__mark_level(order.dir, order.price)
+            if self.__journal is not None:
+                self.__journal.remove(Time.now, order)
+            self.__book_changed()
+
+    def resting_orders(self) -> List[Order]:
+        # Bids then asks, each in priority order
+        orders = []
+        for side in (self.bids, self.asks):
+            for level in side.iter_levels():
+                orders.extend(level.live_orders())
+        return orders
 
     def update(self) -> None:
         super().update()
-        self.__place_orders(*self._orders_to_place)
-        self.__clean_orders()
-        self.__match_orders()
-        self.__clean_orders()
-        self.__remove_resting_market_orders()
-        for order in self._orders_to_place:
+        self.__matching = True
+        orders_to_place, self._orders_to_place = self._orders_to_place, []
+        # Within a batch, later orders at a price queue ahead of earlier ones
+        self.__place_orders(*reversed(orders_to_place))
+        for order in orders_to_place:
+            if not order.voided() and not order.rests():
+                self.__sweep(order)
+                if not order.voided():
+                    order.cancel()
+        if self.__auction_due():
+            self.__run_auction()
+        elif self.auction_interval is None:
+            self.__match_orders()
+        self.__matching = False
+        self.__run_deferred()
+        # Orders placed from callbacks while the book was updating are announced
+        # with the batch but never placed. The journal records them as
+        # cancelled so a replay drops them too.
+        batch_size = len(orders_to_place)
+        orders_to_place.extend(self._orders_to_place)
+        self._orders_to_place = orders_to_place
+        for order in orders_to_place:
             if not order.voided():
                 self.exchange.send_order_update(order)
+        if self.__journal is not None:
+            for order in orders_to_place[batch_size:]:
+                self.__journal.cancel(Time.now, order)
         self._orders_to_place = []
-        self._orders_to_cancel = []
 
-    def public_info(self) -> Tuple[List[Order.PublicInfo], List[Order.PublicInfo]]:
-        return OrderBook.PublicInfo(
-            bids=[order.public_info() for order in self.bids],
-            asks=[order.public_info() for order in self.asks],
+    def crossed(self) -> bool:
+        return (
+            self.__bid is not None
+            and self.__ask is not None
+            and self.__bid >= self.__ask
+        )
+
+    def top_of_book(self) -> OrderBook.TopOfBook:
+        return OrderBook.TopOfBook(
+            self.__bid,
+            self.__bid_size,
+            self.__bid_count,
+            self.__ask,
+            self.__ask_size,
+            self.__ask_count,
+            self.__last_price,
+            self.__last_size,
         )
 
-    def display_str(self, viewer: Union[Agent, None] = None, k: int = 5) -> None:
+    def features(self) -> OrderBook.Features:
+        if self.__depth_mid_stale:
+            self.__refresh_depth_mid()
+        return OrderBook.Features(
+            self.__spread, self.__imbalance, self.__microprice, self.__depth_mid
+        )
+
+    def depth(self, k: int = 5) -> OrderBook.Depth:
         if k == -1:
             k = max(len(self.bids), len(self.asks))
+        return OrderBook.Depth(*self.bids.depth(k), *self.asks.depth(k))
+
+    def public_info(self) -> OrderBook.PublicInfo:
+        # Tuples of the resting orders, worst priority first so that the best
+        # order is at index -1. The snapshot is shared by every reader until
+        # the book changes and is never mutated, so it stays consistent while
+        # the book moves on.
+        key = (Time.now, self.__version)
+        if self.__public_info_key != key:
+            self.__public_info = OrderBook.PublicInfo(
+                bids=tuple(order.public_info() for order in self.bids.orders()),
+                asks=tuple(order.public_info() for order in self.asks.orders()),
+            )
+            self.__public_info_key = key
+        return self.__public_info
+
+    def display_str(self, viewer: Union[Agent, None] = None, k: int = 5) -> None:
+        bids = self.bids.orders()
+        asks = self.asks.orders()
+
+        if k == -1:
+            k = max(len(bids), len(asks))
 
         s = Order.display_header_str(Order.SELL_DIR)
         width = len(s) - 1
         s += "-" * width + "\n"
 
-        if len(self.asks) < k:
-            s += "\n" * (k - len(self.asks))
+        if len(asks) < k:
+            s += "\n" * (k - len(asks))
 
-        for order in self.asks[-k:]:
+        for order in asks[-k:]:
             s += order.display_str(viewer=viewer)
 
         s += "\n\n"
 
-        for order in self.bids[-1 : -k - 1 : -1]:
+        for order in bids[-1 : -k - 1 : -1]:
             s += order.display_str(viewer=viewer)
 
-        if len(self.bids) < k:
-            s += "\n" * (k - len(self.bids))
+        if len(bids) < k:
+            s += "\n" * (k - len(bids))
 
         s += "-" * width + "\n"
         s += Order.display_header_str(Order.BUY_DIR)
@@ -290,46 +864,82 @@ class OrderBook(SimulationObject):
 
 
 class Agent(SimulationObject):
+    Execution = namedtuple("Execution", ["symbol", "dir", "price", "size"])
+
     def __init__(self) -> None:
         super().__init__()
         self.exchanges = {}
         self.open_orders = {}
+        # Consolidated quotes of the agent's exchanges, set by MarketSimulation
+        # when there is more than one
+        self.nbbo = None
 
     def register_exchange(self, exchange: Exchange) -> None:
         self.exchanges[exchange.name] = exchange
 
+    def __get_exchange(self, exchange_name: Union[str, None]) -> Exchange:
+        if (exchange_name is not None and exchange_name not in self.exchanges) or len(
+            self.exchanges.values()
+        ) == 0:
+            raise Exception("Exchange does not exist")
+        if exchange_name is None:
+            return next(iter(self.exchanges.values()))
+        return self.exchanges[exchange_name]
+
+    def route(
+        self, symbol: str, dir: int, price: Union[float, None] = None
+    ) -> Exchange:
+        # Best venue for an order, the first exchange when none stands out
+        exchange = None
+        if self.nbbo is not None:
+            exchange = self.nbbo.route(symbol, dir, price)
+        if exchange is None or exchange.name not in self.exchanges:
+            return self.__get_exchange(None)
+        return exchange
+
+    def routed_order(
+        self,
+        dir: int,
+        price: Union[float, None],
+        size: int,
+        symbol: str,
+        frames_to_expire: Union[int, None] = None,
+        time_in_force: int = Order.GTC,
+    ) -> int:
+        return self.limit_order(
+            dir=dir,
+            price=price,
+            size=size,
+            symbol=symbol,
+            exchange_name=self.route(symbol, dir, price).name,
+            frames_to_expire=frames_to_expire,
+            time_in_force=time_in_force,
+        )
+
     def limit_order(
         self,
         dir: int,
-        price: float,
+        price: Union[float, None],
         size: int,
         symbol: Union[str, None] = None,
         exchange_name: Union[str, None] = None,
         frames_to_expire: Union[int, None] = None,
+        time_in_force: int = Order.GTC,
     ) -> int:
-        if (exchange_name is not None and exchange_name not in self.exchanges) or len(
-            self.exchanges.values()
-        ) == 0:
-            raise Exception("Exchange does not exist")
-        exchange = (
-            list(self.exchanges.values())[0]
-            if exchange_name is None
-            else self.exchanges[exchange_name]
-        )
+        exchange = self.__get_exchange(exchange_name)
         if symbol is None and len(exchange.symbols) == 0:
             raise Exception("Symbol does not exist")
         symbol = exchange.symbols[0] if symbol is None else symbol
-        price = round(round(price / exchange.tick_size) * exchange.tick_size, 2)
         order = Order(
             sender=self,
             symbol=symbol,
             dir=dir,
-            price=price,
+            price=exchange.round_price(price),
             size=size,
             exchange=exchange,
             frames_to_expire=frames_to_expire,
+            time_in_force=time_in_force,
         )
-        self.add_dependent(order)
         self.open_orders[order.id] = order
         return order.place()
 
@@ -344,10 +954,11 @@ class Agent(SimulationObject):
         return self.limit_order(
             symbol=symbol,
             dir=dir,
-            price=(0 if dir == Order.SELL_DIR else effective_inf),
+            price=None,
             size=size,
             exchange_name=exchange_name,
             frames_to_expire=frames_to_expire,
+            time_in_force=Order.MARKET,
         )
 
     def bid(
@@ -415,11 +1026,57 @@ class Agent(SimulationObject):
         )
 
     def cancel(self, order_id: int) -> None:
-        order = Order.get_instance(order_id)
-        if order.sender == self:
-            order.cancel()
+        order = self.open_orders.get(order_id, None)
+        if order is not None:
+            order.exchange.cancel_order(order)
+            return order_id
+
+    def amend(
+        self,
+        order_id: int,
+        price: Union[float, None] = None,
+        size: Union[int, None] = None,
+        frames_to_expire: Union[int, None] = None,
+    ) -> Union[int, None]:
+        order = self.open_orders.get(order_id, None)
+        if order is not None and order.exchange.amend_order(
+            order,
+            price=order.exchange.round_price(price),
+            size=size,
+            frames_to_expire=frames_to_expire,
+        ):
             return order_id
 
+    def quote(
+        self,
+        symbol: str,
+        bid: Union[float, None],
+        bid_size: int,
+        ask: Union[float, None],
+        ask_size: int,
+        exchange_name: Union[str, None] = None,
+        frames_to_expire: Union[int, None] = None,
+    ) -> Tuple[Union[int, None], Union[int, None]]:
+        # A side with no price is left as it is
+        exchange = self.__get_exchange(exchange_name)
+        bid_order, ask_order = exchange.quote(
+            self,
+            symbol,
+            exchange.round_price(bid),
+            bid_size,
+            exchange.round_price(ask),
+            ask_size,
+            frames_to_expire=frames_to_expire,
+        )
+        ids = []
+        for order in (bid_order, ask_order):
+            if order is None:
+                ids.append(None)
+            else:
+                self.open_orders[order.id] = order
+                ids.append(order.id)
+        return tuple(ids)
+
     def cancel_all_open_orders(self) -> None:
         for order_id in self.open_orders:
             self.cancel(order_id)
@@ -427,6 +1084,10 @@ class Agent(SimulationObject):
     def executed_trade(self, symbol: str, dir: int, price: float, size: int) -> None:
         pass
 
+    def executed_trades(self, executions: List[Agent.Execution]) -> None:
+        for execution in executions:
+            self.executed_trade(*execution)
+
     def update(self) -> None:
         super().update()
         self.open_orders = {
@@ -451,23 +1112,36 @@ class Agent(SimulationObject):
 
 
 class Account(SimulationObject):
+    # View of one agent's row in the ledger of an exchange
     CASH_SYM = "USD"
 
-    def __init__(self, agent: Agent) -> None:
+    def __init__(self, agent: Agent, ledger: Ledger) -> None:
         super().__init__()
 
         self.agent = agent
-        self.__holdings = {}
+        self.__ledger = ledger
+        self.__row = ledger.add_account(agent.global_id)
 
-    def get_holding(self, symbol: str) -> int:
-        return self.__holdings.get(symbol.upper(), 0)
+    @property
+    def row(self) -> int:
+        return self.__row
 
-    def set_holding(self, symbol: str, val: int) -> None:
-        self.__holdings[symbol.upper()] = val
+    def get_holding(self, symbol: str) -> Union[int, float]:
+        if symbol == Account.CASH_SYM:
+            return self.__ledger.get_cash(self.__row)
+        return self.__ledger.get_position(self.__row, symbol.upper())
 
-    def update_holding(self, symbol: str, val: int) -> None:
-        super().update()
-        self.set_holding(symbol.upper(), val=val + self.get_holding(symbol))
+    def set_holding(self, symbol: str, val: Union[int, float]) -> None:
+        if symbol == Account.CASH_SYM:
+            self.__ledger.set_cash(self.__row, val)
+        else:
+            self.__ledger.set_position(self.__row, symbol.upper(), val)
+
+    def update_holding(self, symbol: str, val: Union[int, float]) -> None:
+        if symbol == Account.CASH_SYM:
+            self.__ledger.add_cash(self.__row, val)
+        else:
+            self.__ledger.add_position(self.__row, symbol.upper(), val)
 
 
 class Trade(SimulationObject):
@@ -512,6 +1186,9 @@ class Product(SimulationObject):
     def is_expired(self) -> bool:
         return False
 
+    def price_bounds(self) -> Union[Tuple[float, float], None]:
+        return None
+
     def register_exchange(self, exchange: Exchange):
         self.exchanges.append(exchange)
 
@@ -523,6 +1200,8 @@ class Product(SimulationObject):
 
 
 class Event:
+    __slots__ = ("symbol", "event_type", "price", "size", "order_id")
+
     BID = 0
     ASK = 1
     TRADE = 2
@@ -540,7 +1219,26 @@ class Event:
             self.order_id = id
 
 
+class ExchangeClock(SimulationObject):
+    # Dependent of the exchange that updates ahead of the products and agents
+    # so the exchange can expire orders and run its order books first.
+
+    def __init__(self, exchange: Exchange) -> None:
+        super().__init__()
+        self.exchange = exchange
+
+    def update(self) -> None:
+        super().update()
+        self.exchange.on_tick_start()
+
+
 class Exchange(SimulationObject):
+    # symbols and event_types are sets, None for all. events collects the
+    # events of a batched subscription until the end of the tick.
+    Subscription = namedtuple(
+        "Subscription", ["callback", "symbols", "event_types", "events"]
+    )
+
     def __init__(
         self,
         products: Union[List[Product], Product] = [],
@@ -548,6 +1246,14 @@ class Exchange(SimulationObject):
         tick_size: float = 0.01,
         order_fee: float = 0,
         name: Union[str, None] = None,
+        continuous_matching: bool = False,
+        auction_interval: Union[int, None] = None,
+        closing_auction_window: int = 0,
+        jit_matching: bool = False,
+        batch_settlement: bool = False,
+        event_log_size: int = 0,
+        journal_path: Union[str, None] = None,
+        keyframe_interval: int = 1000,
     ) -> None:
         super().__init__(z_index=10)
         self.__name = self.global_id if name is None else name
@@ -557,6 +1263,53 @@ class Exchange(SimulationObject):
 
         self.__order_books = {}
         self.__accounts = {}
+        self.__ledger = Ledger()
+        # mark name -> ((tick, version), marks), see __marks
+        self.__marks_cache = {}
+        self.__marks_version = 0
+
+        self.__tick_size = tick_size
+        self.__order_fee = order_fee
+        self.__continuous_matching = continuous_matching
+        self.__auction_interval = auction_interval
+        self.__closing_auction_window = closing_auction_window
+        self.__jit_matching = jit_matching
+        self.__batch_settlement = batch_settlement
+        # (buyer, seller, symbol, price, size) of trades not settled yet
+        self.__unsettled_trades = []
+
+        self.__expiry_wheel = TimingWheel(start=Time.now)
+        # (agent id, symbol) -> (bid order, ask order) of the agent's last quote
+        self.__quotes = {}
+        self.__delta_callbacks = {}
+
+        # Symbols whose books need an update, see __update_dirty_books
+        self.__book_indices = {}
+        self.__dirty_books = set()
+        self.__dirty_heap = []
+        self.__dirty_next_tick = []
+        self.__update_position = -1
+
+        self.__event_log = EventLog(event_log_size) if event_log_size > 0 else None
+        self.__journal = (
+            None
+            if journal_path is None
+            else Journal(
+                journal_path,
+                keyframe_interval,
+                tick_size=tick_size,
+                start_time=Time.now,
+            )
+        )
+        # Requests made from threads other than the one running the simulation
+        # wait here for the end of the tick, see __queue_if_other_thread
+        self.__thread = None
+        self.__other_thread_requests = deque()
+        self.__top_callbacks = []
+        self.__subscriptions = {}
+        # (symbol, event type) -> [Subscription] in subscription order
+        self.__subscribers = {}
+        self.add_dependent(ExchangeClock(self))
 
         if isinstance(products, Product):
             products = [products]
@@ -564,40 +1317,101 @@ class Exchange(SimulationObject):
         [self.register_product(product) for product in products]
         [self.register_agent(agent) for agent in agents]
 
-        self.__tick_size = tick_size
-        self.__order_fee = order_fee
+    def __on_event(
+        self,
+        symbol: str,
+        event_type: int,
+        price: float,
+        size: int,
+        id: Union[int, None],
+    ) -> None:
+        if self.__event_log is not None:
+            self.__event_log.append(Time.now, symbol, event_type, price, size, id)
+        subscribers = self.__subscribers.get((symbol, event_type), None)
+        if not subscribers:
+            return
+        event = Event(symbol, event_type, price, size, id)
+        for subscription in subscribers:
+            if subscription.events is not None:
+                subscription.events.append(event)
+            else:
+                subscription.callback(event)
+
+    def __index_subscriptions(self) -> None:
+        # Rebuilt rather than edited so a callback may (un)subscribe while
+        # events are being dispatched
+        subscribers = {}
+        for symbol in self.__products:
+            for event_type in (Event.BID, Event.ASK, Event.TRADE):
+                subscribers[(symbol, event_type)] = [
+                    subscription
+                    for subscription in self.__subscriptions.values()
+                    if (subscription.symbols is None or symbol in subscription.symbols)
+                    and (
+                        subscription.event_types is None
+                        or event_type in subscription.event_types
+                    )
+                ]
+        self.__subscribers = subscribers
 
-        self.__subscribed_callbacks = {}
+    def enable_event_log(self, capacity: int) -> EventLog:
+        if self.__event_log is None:
+            self.__event_log = EventLog(capacity)
+        else:
+            self.__event_log.grow(capacity)
+        return self.__event_log
+
+    @property
+    def event_log(self) -> Union[EventLog, None]:
+        return self.__event_log
+
+    @property
+    def journal(self) -> Union[Journal, None]:
+        return self.__journal
+
+    def on_finish(self) -> None:
+        super().on_finish()
+        if self.__journal is not None:
+            self.__journal.flush()
 
-    def __on_event(self, event: Event) -> None:
-        for callback in self.__subscribed_callbacks.values():
-            callback(event)
+    def deliver_events(self) -> None:
+        for subscription in list(self.__subscriptions.values()):
+            if subscription.events:
+                events = subscription.events[:]
+                subscription.events.clear()
+                subscription.callback(events)
 
     def get_account_holdings(self, agent) -> Dict[str, int]:
-        return {
-            symbol: self.__accounts[agent.global_id].get_holding(symbol)
-            for symbol in ([Account.CASH_SYM] + list(self.__products.keys()))
-        }
-    
+        row = self.__accounts[agent.global_id].row
+        holdings = {Account.CASH_SYM: self.__ledger.get_cash(row)}
+        for symbol in self.__products:
+            holdings[symbol] = self.__ledger.get_position(row, symbol)
+        return holdings
+
     def get_total_product_count(self, symbol: str) -> int:
-        count = 0
-        for agent_id in self.__accounts:
-            holding = self.__accounts[agent_id].get_holding(symbol)
-            if holding > 0:
-                count += holding
-        return count
+        return self.__ledger.long_interest(symbol.upper())
+
+    def get_short_product_count(self, symbol: str) -> int:
+        return self.__ledger.short_interest(symbol.upper())
+
+    def top_of_book(self, symbol: str) -> OrderBook.TopOfBook:
+        return self.__order_books[symbol.upper()].top_of_book()
+
+    def book_features(self, symbol: str) -> OrderBook.Features:
+        return self.__order_books[symbol.upper()].features()
+
+    def depth(self, symbol: str, k: int = 5) -> OrderBook.Depth:
+        return self.__order_books[symbol.upper()].depth(k)
 
     def mark_to_mid(self, symbol: str) -> float:
-        order_book = self.public_info()
-        bids = order_book[symbol].bids
-        asks = order_book[symbol].asks
-
-        if len(bids) > 0 and len(asks) > 0:
-            mid = (bids[-1].price + asks[-1].price) / 2
-        elif len(bids) > 0:
-            mid = bids[-1].price
-        elif len(asks) > 0:
-            mid = asks[-1].price
+        top = self.top_of_book(symbol)
+
+        if top.bid is not None and top.ask is not None:
+            mid = (top.bid + top.ask) / 2
+        elif top.bid is not None:
+            mid = top.bid
+        elif top.ask is not None:
+            mid = top.ask
         else:
             mid = 0
 
@@ -614,7 +1428,22 @@ class Exchange(SimulationObject):
     def mark_to_zero(self, symbol: str) -> float:
         return 0
 
-    def get_marked_pnl(self, agent: Agent, mark_to_f: Union[Callable, str] = "mid") -> float:
+    def __marks(self, mark_to_f: Union[Callable, str, None]) -> np.ndarray:
+        # Named marks are cached until the tick ends or a top of book or trade
+        # can move them. Other callables are computed on every call.
+        if mark_to_f is None:
+            mark_to_f = "mid"
+        if type(mark_to_f) != str:
+            return self.__compute_marks(mark_to_f)
+        version = (Time.now, self.__marks_version)
+        cached = self.__marks_cache.get(mark_to_f, None)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        marks = self.__compute_marks(mark_to_f)
+        self.__marks_cache[mark_to_f] = version, marks
+        return marks
+
+    def __compute_marks(self, mark_to_f: Union[Callable, str, None]) -> np.ndarray:
         if mark_to_f is None:
             mark_to_f = self.mark_to_mid
         elif type(mark_to_f) == str:
@@ -625,91 +1454,349 @@ class Exchange(SimulationObject):
                 "zero": self.mark_to_zero,
             }[mark_to_f]
 
-        pnl = self.__accounts[agent.global_id].get_holding(Account.CASH_SYM)
-        for symbol in list(self.__products.keys()):
-            marked_to = mark_to_f(symbol=symbol)
-            pnl += self.__accounts[agent.global_id].get_holding(symbol) * marked_to
-        return pnl
+        # One mark per ledger column, in column order. Columns of symbols
+        # that are not products on this exchange are marked at 0.
+        return np.array(
+            [
+                mark_to_f(symbol=symbol) if symbol in self.__products else 0
+                for symbol in self.__ledger.symbols
+            ],
+            dtype=np.float64,
+        )
+
+    def get_marked_pnl(self, agent: Agent, mark_to_f: Union[Callable, str] = "mid") -> float:
+        return self.__ledger.marked_value(
+            self.__accounts[agent.global_id].row, self.__marks(mark_to_f)
+        )
+
+    def get_marked_pnls(
+        self, mark_to_f: Union[Callable, str] = "mid"
+    ) -> Dict[str, float]:
+        pnls = self.__ledger.marked_values(self.__marks(mark_to_f))
+        return dict(zip(self.__ledger.agent_ids, pnls.tolist()))
+
+    def get_position(self, agent: Agent, symbol: str) -> int:
+        return self.__ledger.get_position(
+            self.__accounts[agent.global_id].row, symbol.upper()
+        )
+
+    def get_total_holding(self, agent: Agent) -> int:
+        return self.__ledger.total_position(self.__accounts[agent.global_id].row)
+
+    def get_cost_basis(self, agent: Agent, symbol: str) -> float:
+        return self.__ledger.cost_basis(
+            self.__accounts[agent.global_id].row, symbol.upper()
+        )
+
+    def get_realized_pnl(self, agent: Agent) -> float:
+        return self.__ledger.realized(self.__accounts[agent.global_id].row)
+
+    def get_unrealized_pnl(
+        self, agent: Agent, mark_to_f: Union[Callable, str] = "mid"
+    ) -> float:
+        return self.__ledger.unrealized(
+            self.__accounts[agent.global_id].row, self.__marks(mark_to_f)
+        )
+
+    def get_net_exposure(
+        self, agent: Agent, mark_to_f: Union[Callable, str] = "mid"
+    ) -> float:
+        return self.__ledger.exposure(
+            self.__accounts[agent.global_id].row, self.__marks(mark_to_f)
+        )
 
-    def place_order(self, order: Order) -> None:
+    def __queue_if_other_thread(self, method: Callable, *args) -> bool:
+        # Requests from another thread, like a display, would touch the books
+        # while they are matching. They are run by the exchange at the end of
+        # the tick instead, before the next tick's books are updated.
+        if self.__thread is None or threading.get_ident() == self.__thread:
+            return False
+        self.__other_thread_requests.append((method, args))
+        return True
+
+    def __run_other_thread_requests(self) -> None:
+        while len(self.__other_thread_requests) > 0:
+            method, args = self.__other_thread_requests.popleft()
+            method(*args)
+
+    def place_order(self, order: Order) -> List[OrderBook.Fill]:
+        if self.__queue_if_other_thread(self.place_order, order):
+            return []
         self.__accounts[order.sender.global_id].update_holding(
             Account.CASH_SYM, -self.order_fee
         )
-        self.__order_books[order.symbol].place_order(order)
+        if self.__journal is not None:
+            self.__journal.order(Time.now, order)
+        if order.expires_at is not None and not order.voided():
+            self.__expiry_wheel.schedule(order, order.expires_at)
+        return self.__order_books[order.symbol].place_order(order)
+
+    def on_tick_start(self) -> None:
+        self.__thread = threading.get_ident()
+        if (
+            self.__journal is not None
+            and Time.now % self.__journal.keyframe_interval == 0
+        ):
+            for symbol, order_book in self.__order_books.items():
+                self.__journal.keyframe(Time.now, symbol, order_book.resting_orders())
+        for order in self.__expiry_wheel.pop_due(Time.now):
+            # An amend can move the expiry, leaving a stale entry behind
+            if not order.voided() and order.expires_at == Time.now:
+                self.__order_books[order.symbol].expire_order(order)
+        self.__update_dirty_books()
+
+    def mark_dirty(self, symbol: str) -> None:
+        if symbol in self.__dirty_books:
+            return
+        self.__dirty_books.add(symbol)
+        index = self.__book_indices[symbol]
+        if index > self.__update_position:
+            heappush(self.__dirty_heap, (index, symbol))
+        else:
+            # Books already updated this tick wait for the next one
+            self.__dirty_next_tick.append(symbol)
+
+    def __update_dirty_books(self) -> None:
+        # Only books touched since their last update are run, in registration
+        # order, so a book dirtied by the callbacks of an earlier book in the
+        # same tick is still updated this tick
+        while len(self.__dirty_heap) > 0:
+            index, symbol = heappop(self.__dirty_heap)
+            self.__dirty_books.discard(symbol)
+            self.__update_position = index
+            order_book = self.__order_books[symbol]
+            order_book.update()
+            if order_book.crossed():
+                # Waiting for its next call auction
+                self.mark_dirty(symbol)
+        self.__update_position = -1
+        for symbol in self.__dirty_next_tick:
+            heappush(self.__dirty_heap, (self.__book_indices[symbol], symbol))
+        self.__dirty_next_tick = []
+
+    def cancel_order(self, order: Order) -> None:
+        if self.__queue_if_other_thread(self.cancel_order, order):
+            return
+        if self.__journal is not None:
+            self.__journal.cancel(Time.now, order)
+        self.__order_books[order.symbol].cancel_order(order)
+
+    def amend_order(
+        self,
+        order: Order,
+        price: Union[float, None] = None,
+        size: Union[int, None] = None,
+        frames_to_expire: Union[int, None] = None,
+    ) -> bool:
+        if self.__queue_if_other_thread(
+            self.amend_order, order, price, size, frames_to_expire
+        ):
+            return True
+        expires_at = order.expires_at
+        if frames_to_expire is not None and order.rests():
+            expires_at = Time.now + frames_to_expire + 1
+        if self.__journal is not None:
+            self.__journal.amend(Time.now, order, price, size, expires_at)
+        previous_expiry = order.expires_at
+        amended = self.__order_books[order.symbol].amend_order(
+            order, price, size, expires_at
+        )
+        if amended and expires_at != previous_expiry and not order.voided():
+            self.__expiry_wheel.schedule(order, expires_at)
+        return amended
+
+    def quote(
+        self,
+        agent: Agent,
+        symbol: str,
+        bid: Union[float, None],
+        bid_size: int,
+        ask: Union[float, None],
+        ask_size: int,
+        frames_to_expire: Union[int, None] = None,
+    ) -> Tuple[Union[Order, None], Union[Order, None]]:
+        # A side quoted at None keeps its current order, or None if it has none
+        symbol = symbol.upper()
+        quotes = self.__quotes.get((agent.global_id, symbol), (None, None))
+        new_quotes = []
+        for order, dir, price, size in zip(
+            quotes, (Order.BUY_DIR, Order.SELL_DIR), (bid, ask), (bid_size, ask_size)
+        ):
+            if price is None:
+                pass
+            elif order is None or order.voided():
+                order = Order(agent, symbol, dir, price, size, self, frames_to_expire)
+                self.place_order(order)
+            else:
+                self.amend_order(order, price, size, frames_to_expire)
+            new_quotes.append(order)
+        self.__quotes[(agent.global_id, symbol)] = tuple(new_quotes)
+        return tuple(new_quotes)
+
+    def subscribe_top(
+        self, callback: Callable[[Exchange, str, float, int, float, int], None]
+    ) -> None:
+        self.__top_callbacks.append(callback)
+
+    def top_changed(
+        self,
+        symbol: str,
+        bid: Union[float, None],
+        bid_size: int,
+        ask: Union[float, None],
+        ask_size: int,
+    ) -> None:
+        self.__marks_version += 1
+        for callback in self.__top_callbacks:
+            callback(self, symbol, bid, bid_size, ask, ask_size)
+
+    def send_book_deltas(self, deltas: List[BookDelta]) -> None:
+        for callback in list(self.__delta_callbacks.values()):
+            for delta in deltas:
+                callback(delta)
+
+    def book_snapshot(self, symbol: str) -> BookSnapshot:
+        return self.__order_books[symbol.upper()].snapshot()
+
+    def recover_book(
+        self, symbol: str, seq: Union[int, None]
+    ) -> Tuple[Union[BookSnapshot, None], List[BookDelta]]:
+        return self.__order_books[symbol.upper()].recover(seq)
 
     def send_order_update(self, order: Order) -> None:
         self.__on_event(
-            Event(
-                order.symbol,
-                Event.BID if order.dir == Order.BUY_DIR else Event.ASK,
-                order.price,
-                order.size,
-                order.id,
-            )
+            order.symbol,
+            Event.BID if order.dir == Order.BUY_DIR else Event.ASK,
+            order.price,
+            order.size,
+            order.id,
         )
 
     def execute_trade(
         self, symbol: str, price: float, size: int, buyer: Agent, seller: Agent
     ) -> None:
-        self.__on_event(Event(symbol, Event.TRADE, price, size, None))
+        self.__on_event(symbol, Event.TRADE, price, size, None)
         self.__products[symbol.upper()].record_trade(price, size, buyer, seller)
-        self.__accounts[buyer.global_id].update_holding(Account.CASH_SYM, -price * size)
-        self.__accounts[buyer.global_id].update_holding(symbol, size)
-        self.__accounts[seller.global_id].update_holding(Account.CASH_SYM, price * size)
-        self.__accounts[seller.global_id].update_holding(symbol, -size)
+        self.__marks_version += 1
+        if self.__batch_settlement:
+            self.__unsettled_trades.append((buyer, seller, symbol, price, size))
+            return
+        self.__ledger.settle(
+            self.__accounts[buyer.global_id].row,
+            self.__accounts[seller.global_id].row,
+            symbol.upper(),
+            price,
+            size,
+        )
         buyer.executed_trade(symbol=symbol, dir=Order.BUY_DIR, price=price, size=size)
         seller.executed_trade(symbol=symbol, dir=Order.SELL_DIR, price=price, size=size)
 
+    def settle_trades(self) -> None:
+        # Settle the trades collected in batch settlement mode and tell each
+        # agent about its fills with one executed_trades call
+        if len(self.__unsettled_trades) == 0:
+            return
+        trades, self.__unsettled_trades = self.__unsettled_trades, []
+        buyers, sellers, symbols, prices, sizes = zip(*trades)
+        self.__ledger.settle_batch(
+            np.array([self.__accounts[agent.global_id].row for agent in buyers]),
+            np.array([self.__accounts[agent.global_id].row for agent in sellers]),
+            np.array([self.__ledger.add_symbol(symbol.upper()) for symbol in symbols]),
+            np.array(prices, dtype=np.float64),
+            np.array(sizes, dtype=np.int64),
+        )
+
+        executions = {}
+        for buyer, seller, symbol, price, size in trades:
+            executions.setdefault(buyer, []).append(
+                Agent.Execution(symbol, Order.BUY_DIR, price, size)
+            )
+            executions.setdefault(seller, []).append(
+                Agent.Execution(symbol, Order.SELL_DIR, price, size)
+            )
+        for agent in executions:
+            agent.executed_trades(executions[agent])
+
     def register_product(self, product: Product) -> bool:
         if product.symbol not in self.__order_books:
-            self.__order_books[product.symbol] = OrderBook(product.symbol, self)
+            self.__order_books[product.symbol] = OrderBook(
+                product.symbol,
+                self,
+                price_bounds=product.price_bounds(),
+                continuous=self.__continuous_matching,
+                auction_interval=self.__auction_interval,
+                closing_auction_window=self.__closing_auction_window,
+                jit_matching=self.__jit_matching,
+            )
+            if len(self.__delta_callbacks) > 0:
+                self.__order_books[product.symbol].enable_delta_feed()
+            self.__book_indices[product.symbol] = len(self.__book_indices)
+            self.__ledger.add_symbol(product.symbol)
             self.__products[product.symbol] = product
+            self.__index_subscriptions()
             self.add_dependent(self.__products[product.symbol])
-            self.add_dependent(self.__order_books[product.symbol])
             product.register_exchange(self)
             return True
         return False
 
     def register_agent(self, agent: Agent) -> bool:
         if agent.global_id not in self.__accounts:
-            self.__accounts[agent.global_id] = Account(agent)
+            self.__accounts[agent.global_id] = Account(agent, self.__ledger)
             self.__agents[agent.global_id] = agent
             agent.register_exchange(self)
             return True
         return False
 
-    def subscribe(self, agent: Agent, callback: Callable[[Event], None]) -> None:
-        self.__subscribed_callbacks[agent.global_id] = callback
+    def subscribe(
+        self,
+        agent: Agent,
+        callback: Union[Callable[[Event], None], Callable[[List[Event]], None]],
+        symbols: Union[List[str], None] = None,
+        event_types: Union[List[int], None] = None,
+        batched: bool = False,
+    ) -> None:
+        # With batched set, callback gets the list of the tick's events once
+        # at the end of the tick instead of each event as it happens
+        self.__subscriptions[agent.global_id] = Exchange.Subscription(
+            callback,
+            None if symbols is None else set(symbol.upper() for symbol in symbols),
+            None if event_types is None else set(event_types),
+            [] if batched else None,
+        )
+        self.__index_subscriptions()
 
     def unsubscribe(self, agent: Agent) -> None:
-        del self.__subscribed_callbacks[agent.global_id]
+        del self.__subscriptions[agent.global_id]
+        self.__index_subscriptions()
+
+    def subscribe_book_deltas(
+        self, agent: Agent, callback: Callable[[BookDelta], None]
+    ) -> None:
+        self.__delta_callbacks[agent.global_id] = callback
+        for order_book in self.__order_books.values():
+            order_book.enable_delta_feed()
+
+    def unsubscribe_book_deltas(self, agent: Agent) -> None:
+        del self.__delta_callbacks[agent.global_id]
 
     def update(self) -> None:
         super().update()
+        self.__run_other_thread_requests()
+        self.deliver_events()
+        # The tick's one batched settlement, after the last trades of the tick
+        # and before dividends and expiries are paid on the positions
+        self.settle_trades()
         for symbol in self.__products:
             product = self.__products[symbol]
             dividend = product.dividend()
-            expired = product.is_expired()
-            payout = None
-            if expired:
-                payout = product.payout()
-            for agent_id in self.__accounts:
-                product_holding = self.__accounts[agent_id].get_holding(symbol)
-                if product_holding != 0:
-                    self.__accounts[agent_id].update_holding(
-                        Account.CASH_SYM, product_holding * dividend
-                    )
-                    if expired:
-                        self.__accounts[agent_id].set_holding(symbol, 0)
-                        self.__accounts[agent_id].update_holding(
-                            Account.CASH_SYM, product_holding * payout
-                        )
+            if dividend != 0:
+                self.__ledger.accrue(symbol, dividend)
+            if product.is_expired():
+                self.__ledger.close_out(symbol, product.payout())
 
     @SimulationObject.cache_wrapper
-    def public_info(self) -> Dict[str, OrderBook.PublicInfo]:
-        return {
-            symbol: self.__order_books[symbol].public_info() for symbol in self.symbols
-        }
+    def public_info(self) -> ExchangeView:
+        return ExchangeView(self.__order_books)
 
     def display_str(self, viewer: Union[Agent, None] = None, k: int = 5) -> str:
         s = f"Exchange: {self.name}\n"
@@ -721,15 +1808,9 @@ class Exchange(SimulationObject):
         return s + "\n\n"
 
     def payout_for_holdings(self):
+        self.settle_trades()
         for symbol in self.__products:
-            product = self.__products[symbol]
-            payout = product.payout()
-            for agent_id in self.__accounts:
-                product_holding = self.__accounts[agent_id].get_holding(symbol)
-                self.__accounts[agent_id].set_holding(symbol, 0)
-                self.__accounts[agent_id].update_holding(
-                    Account.CASH_SYM, product_holding * payout
-                )
+            self.__ledger.close_out(symbol, self.__products[symbol].payout())
 
     @property
     def time_remaining(self) -> int:
@@ -739,6 +1820,15 @@ class Exchange(SimulationObject):
     def open(self) -> bool:
         return self.simulation.started and not self.simulation.finished
 
+    def round_price(self, price: Union[float, None]) -> Union[float, None]:
+        if price is None:
+            return None
+        return round(round(price / self.tick_size) * self.tick_size, 2)
+
+    @property
+    def continuous_matching(self) -> bool:
+        return self.__continuous_matching
+
     @property
     def order_fee(self) -> float:
         return self.__order_fee
@@ -1,5 +1,3 @@
 def prefix_lines(s, prefix=""):
     return "\n".join([prefix + line for line in s.split("\n")])
 
-
-effective_inf = 1e8